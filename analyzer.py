@@ -1,8 +1,10 @@
-import PIL
-import pytesseract
+import PIL.Image
 from typing import List
 import numpy as np
 
+from complexity import complexity_scores
+from router import RoutingPolicy, page_features
+
 
 class FileAnalyzer:
     """
@@ -15,20 +17,28 @@ class FileAnalyzer:
     def __init__(
             self, 
             images: list[PIL.Image.Image], 
-            text_threshold: float = 0.75, 
-            deep_analysis: bool = False
+            text_threshold: float | None = None, 
+            deep_analysis: bool = False,
+            policy: RoutingPolicy | None = None
             ):
         """
         Args:
-            images: list of PIL.Image.Image of the images to process
+            images: list of PIL.Image.Image of the images to process, or a file-backed
+            PageSequence that decodes pages on access
             text_threshold: float of the threshold to use for the GPT-4o model. If above this
-            threshold, the text will be extracted and used to create flashcards.
+            threshold, the text will be extracted and used to create flashcards. If None,
+            the threshold of the policy is used (0.75 unless the policy file sets one).
             deep_analysis: bool of whether to perform a deep analysis of the page. If false.
             only the text ratio is calculated and the text is extracted.
+            policy: RoutingPolicy used to choose the model tier of each page. If None,
+            the fitted policy is loaded from disk, falling back to the text_threshold rule.
         """
         self.images = images
-        self.text_threshold = text_threshold
         self.deep_analysis = deep_analysis # If false, only the text ratio is calculated
+        self.policy = policy or RoutingPolicy.load()
+        if text_threshold is not None:
+            self.policy.text_threshold = text_threshold
+        self.text_threshold = self.policy.text_threshold
 
     def __extract_text(self) -> dict[int, str]:
         """
@@ -38,6 +48,8 @@ class FileAnalyzer:
             dict[int, str]: A dictionary of extracted text from each image
             where the key is the page index and the value is the extracted text.
         """
+        import pytesseract
+
         extracted_texts = {}
         
         for idx, image in enumerate(self.images):
@@ -99,63 +111,6 @@ class FileAnalyzer:
         
         return extracted_graphics
     
-    def __extract_graphics(self) -> dict[int, List[PIL.Image.Image]]:
-        """
-        Extract graphics from all pages.
-
-        Returns:
-            dict[int, List[PIL.Image.Image]]: A dictionary of extracted graphics from each page 
-            where the key is the page index and the value is a list of extracted graphics.
-        """
-        extracted_graphics = {}
-
-        for idx, image in enumerate(self.images):
-            extracted_graphics[idx] = self.__extract_graphics_from_page(image)
-
-        return extracted_graphics
-    
-
-    def __calculate_complexity(self, text: str, graphics: List[PIL.Image.Image]) -> float:
-        """
-        Calculate the content complexity of the page.
-
-        Args:
-            text: str of the text to process
-            graphics: list of PIL.Image.Image of the graphics to process
-
-        Returns:
-            float: The complexity score of the page
-        """
-        complexity = 0.0
-
-        if text:
-            # 1. special character ratio
-            special_char_ratio = sum(1 for char in text if not char.isalnum()) / len(text) if text else 0
-
-            # 2. word length variance
-            words = text.split()
-            avg_word_length = sum(len(word) for word in words) / len(words) if words else 0
-            word_length_variance = sum((len(word) - avg_word_length) ** 2 for word in words) / len(words) if words else 0
-
-            # 3. Line density
-            line_count = text.count("\n")
-
-            complexity += min(0.4, special_char_ratio)
-            complexity += min(0.3, word_length_variance / 10)
-            complexity += min(0.3, line_count / 50)
-            
-        if graphics:
-            # 1. Number of graphics
-            complexity += min(0.3, len(graphics) / 10)
-
-            # 2. Size variance
-            
-            avg_size = sum(g.width*g.height for g in graphics)/len(graphics) if graphics else 0
-            size_var = sum((g.width*g.height-avg_size)**2 for g in graphics)/len(graphics) if graphics else 0
-            complexity += min(0.3, size_var / (avg_size + 1) * 0.1)
-    
-        return min(1.0, complexity) 
-
     def __calculate_text_area(self, image: PIL.Image.Image) -> float:
         """
         Calculate the area of the text in the image using OCR bounding boxes.
@@ -166,6 +121,8 @@ class FileAnalyzer:
         Returns:
             float: The area of the text in the image
         """
+        import pytesseract
+
         try:
             # Use Tesseract to get text bounding boxes
             ocr_data = pytesseract.image_to_data(
@@ -192,22 +149,29 @@ class FileAnalyzer:
         Returns:
             dict[int, dict]: A dictionary where keys are page indices and values are 
             analysis dictionaries containing:
-            - use_gpt4o: bool (whether to use GPT-4o)
+            - use_gpt4o: bool (whether the chosen model needs the page image)
+            - model: str (model chosen by the routing policy)
+            - features: dict (routing features of the page)
             - text_ratio: float (percentage of text content)
             - text_area: int (pixel area of text)
             - graphics_area: int (pixel area of graphics)
             - complexity_score: float (0-1 score of content complexity)
+            - formula_density, bullet_ratio, table_ratio, digit_ratio: float (text
+              structure features, see complexity.text_features)
             - text: str (extracted text from the page)
         """
         # Always extract text as it's needed for basic analysis
         extracted_texts = self.__extract_text()
         
-        # Only extract graphics if deep analysis is enabled
-        extracted_graphics = self.__extract_graphics() if self.deep_analysis else {}
-        
         analysis_results = {}
+        graphics_sizes = []
         
         for page_idx, image in enumerate(self.images):
+            # Only extract graphics if deep analysis is enabled. Graphics are extracted
+            # page by page so that only the crops of the current page are held in memory
+            graphics = self.__extract_graphics_from_page(image) if self.deep_analysis else []
+            graphics_sizes.append([g.width * g.height for g in graphics])
+
             # Calculate text ratio (always needed)
             text_length = len(extracted_texts[page_idx].strip())
             page_width, page_height = image.size
@@ -218,10 +182,7 @@ class FileAnalyzer:
                 text_area = self.__calculate_text_area(image)
                 
                 # Calculate graphics area
-                graphics_area = sum(
-                    g.width * g.height 
-                    for g in extracted_graphics.get(page_idx, [])
-                )
+                graphics_area = sum(graphics_sizes[-1])
                 
                 # Calculate content ratios
                 content_area = text_area + graphics_area
@@ -231,32 +192,39 @@ class FileAnalyzer:
                 else:
                     text_ratio = 0
                     graphics_ratio = 0
-                
-                # Calculate complexity factors
-                complexity_score = self.__calculate_complexity(
-                    extracted_texts[page_idx],
-                    extracted_graphics.get(page_idx, [])
-                )
             else:
                 # Simple text ratio calculation for basic analysis
                 text_area = text_length * 100  # Rough estimate of text area
                 graphics_area = 0
                 text_ratio = text_length / (page_width * page_height) if text_length > 0 else 0
                 graphics_ratio = 0
-                complexity_score = 0
-            
-            # Determine model recommendation. TODO: tweak thresholds        
-            use_gpt4o = (text_ratio < self.text_threshold) or (complexity_score > 0.9)
             
             analysis_results[page_idx] = {
-                'use_gpt4o': use_gpt4o,
                 'text_ratio': text_ratio,
                 'text_area': text_area,
                 'graphics_area': graphics_area,
-                'complexity_score': complexity_score,
+                'complexity_score': 0,
                 'page_dimensions': (page_width, page_height),
-                'graphics_count': len(extracted_graphics.get(page_idx, [])),
+                'graphics_count': len(graphics),
                 'text': extracted_texts[page_idx]
             }
+
+        # Score all pages in one vectorized pass. The text features are cheap and
+        # always computed, the complexity score only counts in deep analysis.
+        texts = [extracted_texts[idx] for idx in range(len(analysis_results))]
+        scores, text_features = complexity_scores(texts, graphics_sizes)
+
+        for page_idx, analysis in analysis_results.items():
+            if self.deep_analysis:
+                analysis['complexity_score'] = float(scores[page_idx])
+            for name in ('formula_density', 'bullet_ratio', 'table_ratio', 'digit_ratio'):
+                analysis[name] = float(text_features[name][page_idx])
+
+            # Determine model recommendation from the routing policy
+            features = page_features(analysis)
+            tier = self.policy.choose(features)
+            analysis['use_gpt4o'] = tier['input'] == 'image'
+            analysis['model'] = tier['model']
+            analysis['features'] = features
         
-        return analysis_results
\ No newline at end of file
+        return analysis_results
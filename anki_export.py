@@ -0,0 +1,418 @@
+import hashlib
+import html
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+from structures import FlashCardStruct
+
+
+# Fixed model id so that re-exported notes always belong to the same note type,
+# which is required for Anki to update existing notes instead of duplicating them.
+MODEL_ID = 1607392319
+MODEL_NAME = "Minimalist Anki Basic"
+
+_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null,
+    scm integer not null, ver integer not null, dty integer not null,
+    usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null,
+    tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null,
+    mod integer not null, usn integer not null, tags text not null,
+    flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null,
+    ord integer not null, mod integer not null, usn integer not null,
+    type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null,
+    odid integer not null, flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null,
+    ease integer not null, ivl integer not null, lastIvl integer not null,
+    factor integer not null, time integer not null, type integer not null
+);
+CREATE TABLE graves (
+    usn integer not null, oid integer not null, type integer not null
+);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+CREATE UNIQUE INDEX ix_notes_guid on notes (guid);
+"""
+
+_CSS = """.card {
+ font-family: arial;
+ font-size: 20px;
+ text-align: left;
+ color: black;
+ background-color: white;
+}
+"""
+
+
+def note_guid(flashcard: FlashCardStruct) -> str:
+    """
+    Derive a stable note GUID from the chapter and the question of a flashcard.
+    The answer is deliberately left out so that a regenerated answer updates the
+    existing note on re-import instead of creating a new one.
+
+    Args:
+        flashcard: FlashCardStruct object
+    Returns:
+        str: 16 character hex GUID
+    """
+    key = f"{flashcard.chapter}\x1f{' '.join(flashcard.question.split())}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def deck_id(deck_name: str) -> int:
+    """
+    Derive a stable deck id from the deck name.
+
+    Args:
+        deck_name: name of the deck
+    Returns:
+        int: deck id
+    """
+    return int(hashlib.sha1(deck_name.encode("utf-8")).hexdigest()[:12], 16)
+
+
+def _to_field(text: str) -> str:
+    """
+    Convert raw model output to an Anki HTML field.
+    """
+    return html.escape(text.strip(), quote=False).replace("\n", "<br>")
+
+
+def _checksum(field: str) -> int:
+    """
+    Anki's duplicate-check checksum of the sort field.
+    """
+    return int(hashlib.sha1(field.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _model(now: int, did: int) -> dict:
+    return {
+        str(MODEL_ID): {
+            "id": MODEL_ID,
+            "name": MODEL_NAME,
+            "type": 0,
+            "mod": now,
+            "usn": -1,
+            "sortf": 0,
+            "did": did,
+            "tmpls": [{
+                "name": "Card 1",
+                "ord": 0,
+                "qfmt": "{{Front}}",
+                "afmt": "{{FrontSide}}<hr id=answer>{{Back}}",
+                "did": None,
+                "bqfmt": "",
+                "bafmt": "",
+            }],
+            "flds": [
+                {"name": "Front", "ord": 0, "sticky": False, "rtl": False,
+                 "font": "Arial", "size": 20, "media": []},
+                {"name": "Back", "ord": 1, "sticky": False, "rtl": False,
+                 "font": "Arial", "size": 20, "media": []},
+            ],
+            "css": _CSS,
+            "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n"
+                        "\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n"
+                        "\\setlength{\\parindent}{0in}\n\\begin{document}\n",
+            "latexPost": "\\end{document}",
+            "tags": [],
+            "vers": [],
+            "req": [[0, "any", [0]]],
+        }
+    }
+
+
+def _deck(deck_name: str, did: int, now: int) -> dict:
+    common = {
+        "mod": now, "usn": -1, "lrnToday": [0, 0], "revToday": [0, 0],
+        "newToday": [0, 0], "timeToday": [0, 0], "collapsed": False,
+        "desc": "", "dyn": 0, "conf": 1, "extendNew": 10, "extendRev": 50,
+    }
+    return {
+        "1": {"id": 1, "name": "Default", **common},
+        str(did): {"id": did, "name": deck_name, **common},
+    }
+
+
+_DCONF = {
+    "1": {
+        "id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60,
+        "autoplay": True, "timer": 0, "replayq": True, "dyn": False,
+        "new": {"bury": True, "delays": [1, 10], "initialFactor": 2500,
+                "ints": [1, 4, 7], "order": 1, "perDay": 20, "separate": True},
+        "lapse": {"delays": [10], "leechAction": 0, "leechFails": 8,
+                  "minInt": 1, "mult": 0},
+        "rev": {"bury": True, "ease4": 1.3, "fuzz": 0.05, "ivlFct": 1,
+                "maxIvl": 36500, "minSpace": 1, "perDay": 100},
+    }
+}
+
+
+class AnkiPackage:
+    """
+    Writer for Anki .apkg packages (a zip archive holding a SQLite collection and
+    media files). Notes are keyed by a stable GUID, so exporting the same chapter
+    again updates the existing cards instead of duplicating them. Opening an
+    existing package only touches the notes that are new or changed, existing
+    cards keep their ids and media entries are copied over as they are.
+    """
+    def __init__(self, path: str | Path, deck_name: str = "default"):
+        """
+        Args:
+            path: path of the .apkg file. If it exists, its collection and media
+            are loaded and new flashcards are added incrementally.
+            deck_name: name of the deck new cards are added to
+        """
+        self.path = Path(path)
+        self.deck_name = deck_name
+        self.deck_id = deck_id(deck_name)
+        self.media = {}  # file name -> bytes of media added in this session
+
+        fd, self._db_path = tempfile.mkstemp(suffix=".anki2")
+        os.close(fd)
+        self._existing_media = []  # file names already stored in the package
+
+        if self.path.exists():
+            with zipfile.ZipFile(self.path) as package:
+                with open(self._db_path, "wb") as db_file:
+                    db_file.write(package.read("collection.anki2"))
+                if "media" in package.namelist():
+                    self._existing_media = list(json.loads(package.read("media")).values())
+            self.conn = sqlite3.connect(self._db_path)
+            self.__ensure_deck()
+        else:
+            self.conn = sqlite3.connect(self._db_path)
+            self.__init_collection()
+
+        # mod of notes are in seconds, ids in milliseconds. Start past the max
+        # existing id so new ids never collide with imported ones.
+        max_id = self.conn.execute(
+            "SELECT max(coalesce((SELECT max(id) FROM notes), 0), "
+            "coalesce((SELECT max(id) FROM cards), 0))"
+        ).fetchone()[0]
+        self._next_id = max(int(time.time() * 1000), max_id + 1)
+
+    def __init_collection(self):
+        """
+        Create an empty collection with the note type and deck.
+        """
+        now = int(time.time())
+        self.conn.executescript(_SCHEMA)
+        self.conn.execute(
+            "INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+            (
+                now, now * 1000, now * 1000,
+                json.dumps({"nextPos": 1, "curDeck": self.deck_id, "curModel": str(MODEL_ID)}),
+                json.dumps(_model(now, self.deck_id)),
+                json.dumps(_deck(self.deck_name, self.deck_id, now)),
+                json.dumps(_DCONF),
+            )
+        )
+        self.conn.commit()
+
+    def __ensure_deck(self):
+        """
+        Register the note type and deck in an existing collection if missing.
+        """
+        now = int(time.time())
+        models_json, decks_json = self.conn.execute("SELECT models, decks FROM col").fetchone()
+        models = json.loads(models_json)
+        decks = json.loads(decks_json)
+        models.update({k: v for k, v in _model(now, self.deck_id).items() if k not in models})
+        decks.update({k: v for k, v in _deck(self.deck_name, self.deck_id, now).items() if k not in decks})
+        self.conn.execute(
+            "UPDATE col SET models = ?, decks = ?", (json.dumps(models), json.dumps(decks))
+        )
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_notes_guid on notes (guid)")
+        self.conn.commit()
+
+    def add_media(self, file_name: str, data: bytes):
+        """
+        Add a media file to the package. Reference it from a flashcard with
+        <img src="file_name">.
+
+        Args:
+            file_name: name of the media file inside the collection
+            data: raw bytes of the file
+        """
+        if file_name not in self._existing_media:
+            self.media[file_name] = data
+
+    def add_flashcards(self, flashcards: list[FlashCardStruct]) -> tuple[int, int]:
+        """
+        Add flashcards to the collection. Notes whose GUID already exists are
+        updated in place if their content changed, all others are inserted.
+
+        Args:
+            flashcards: list of FlashCardStruct objects
+        Returns:
+            tuple[int, int]: (number of added notes, number of updated notes)
+        """
+        now = int(time.time())
+        existing = dict(self.conn.execute("SELECT guid, flds FROM notes"))
+        next_pos = self.conn.execute("SELECT coalesce(max(due), 0) + 1 FROM cards WHERE type = 0").fetchone()[0]
+
+        new_notes, new_cards, updates = [], [], []
+        for flashcard in flashcards:
+            guid = note_guid(flashcard)
+            front = _to_field(flashcard.question)
+            flds = f"{front}\x1f{_to_field(flashcard.answer)}"
+            tags = f" {flashcard.chapter.replace(' ', '_')} "
+
+            if guid in existing:
+                if existing[guid] != flds:
+                    updates.append((now, tags, flds, front, _checksum(front), guid))
+                    existing[guid] = flds
+                continue
+
+            note_id = self._next_id
+            card_id = self._next_id + 1
+            self._next_id += 2
+            existing[guid] = flds
+            new_notes.append((note_id, guid, MODEL_ID, now, -1, tags, flds, front, _checksum(front), 0, ""))
+            new_cards.append((card_id, note_id, self.deck_id, 0, now, -1, 0, 0, next_pos, 0, 0, 0, 0, 0, 0, 0, 0, ""))
+            next_pos += 1
+
+        with self.conn:
+            self.conn.executemany("INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)", new_notes)
+            self.conn.executemany("INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", new_cards)
+            self.conn.executemany(
+                "UPDATE notes SET mod = ?, usn = -1, tags = ?, flds = ?, sfld = ?, csum = ? WHERE guid = ?",
+                updates
+            )
+            self.conn.execute("UPDATE col SET mod = ?", (now * 1000,))
+
+        return len(new_notes), len(updates)
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the package to .apkg bytes, e.g. for a download button.
+
+        Returns:
+            bytes: content of the .apkg file
+        """
+        fd, tmp_path = tempfile.mkstemp(suffix=".apkg")
+        os.close(fd)
+        try:
+            self.__write(Path(tmp_path))
+            return Path(tmp_path).read_bytes()
+        finally:
+            os.remove(tmp_path)
+
+    def save(self, path: str | Path | None = None):
+        """
+        Write the package to disk. The archive is first written to a temporary
+        file next to the target and then moved in place.
+
+        Args:
+            path: target path, defaults to the path the package was opened with
+        """
+        target = Path(path) if path else self.path
+        tmp_path = target.with_suffix(target.suffix + ".tmp")
+        self.__write(tmp_path)
+        os.replace(tmp_path, target)
+        if target.resolve() == self.path.resolve():
+            # The session media is now part of the package on disk
+            self._existing_media.extend(self.media)
+            self.media = {}
+
+    def __write(self, target: Path):
+        self.conn.commit()
+        # Copy the live database so we never zip a file sqlite is writing to
+        backup = sqlite3.connect(":memory:")
+        self.conn.backup(backup)
+        fd, snapshot = tempfile.mkstemp(suffix=".anki2")
+        os.close(fd)
+        try:
+            disk = sqlite3.connect(snapshot)
+            backup.backup(disk)
+            disk.close()
+            backup.close()
+
+            media_index = {}
+            with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as out:
+                out.write(snapshot, "collection.anki2")
+
+                if self._existing_media and self.path.exists():
+                    with zipfile.ZipFile(self.path) as src:
+                        src_index = json.loads(src.read("media"))
+                        for number, file_name in src_index.items():
+                            # Media is mostly already compressed (png/jpg), store as is
+                            out.writestr(str(len(media_index)), src.read(number), zipfile.ZIP_STORED)
+                            media_index[str(len(media_index))] = file_name
+
+                written = set(media_index.values())
+                for file_name, data in self.media.items():
+                    if file_name in written:
+                        continue
+                    out.writestr(str(len(media_index)), data, zipfile.ZIP_STORED)
+                    media_index[str(len(media_index))] = file_name
+
+                out.writestr("media", json.dumps(media_index))
+        finally:
+            os.remove(snapshot)
+
+    def close(self):
+        """
+        Close the collection and remove the temporary database.
+        """
+        self.conn.close()
+        if os.path.exists(self._db_path):
+            os.remove(self._db_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def flashcard_struct_to_apkg(
+        flashcards: list[FlashCardStruct],
+        deck_name: str,
+        existing_package: bytes | None = None) -> bytes:
+    """
+    Convert a list of FlashCardStruct to the bytes of an .apkg package.
+    Args:
+        flashcards: list of FlashCardStruct objects
+        deck_name: name of the Anki deck
+        existing_package: optional bytes of a previously exported package the
+        flashcards are merged into
+    Returns:
+        bytes: content of the .apkg file
+    """
+    fd, path = tempfile.mkstemp(suffix=".apkg")
+    os.close(fd)
+    try:
+        if existing_package:
+            Path(path).write_bytes(existing_package)
+        else:
+            os.remove(path)
+        with AnkiPackage(path, deck_name) as package:
+            package.add_flashcards(flashcards)
+            return package.to_bytes()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
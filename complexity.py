@@ -0,0 +1,178 @@
+import numpy as np
+
+
+# Characters counting towards the formula density of a page
+MATH_CHARS = set("=+-*/^_<>|~()[]{}\\%") | set(
+    "±×÷·∙√∛∞∝∂∆∇∑∏∫∮≈≠≡≤≥≪≫⊂⊃⊆⊇∈∉∩∪∧∨¬∀∃∄→←↔⇒⇐⇔′″"
+    "αβγδεζηθικλμνξοπρστυφχψωΓΔΘΛΞΠΣΦΨΩ"
+)
+# First characters of a line that mark a bullet point
+BULLET_CHARS = set("•◦▪▫■□●○‣⁃–—-*·>")
+
+_BMP = 0x10000
+_ALNUM, _SPACE, _MATH, _DIGIT, _BULLET = 1, 2, 4, 8, 16
+_table = None
+
+
+def _char_flags(c: str) -> int:
+    return (
+        _ALNUM * c.isalnum()
+        | _SPACE * c.isspace()
+        | _MATH * (c in MATH_CHARS)
+        | _DIGIT * c.isdigit()
+        | _BULLET * (c in BULLET_CHARS)
+    )
+
+
+def _classify(codes: np.ndarray) -> np.ndarray:
+    """
+    Look up the character class flags of an array of code points. The table covers
+    the basic multilingual plane and is built once on first use, the rare code points
+    above it are classified one by one.
+    """
+    global _table
+    if _table is None:
+        _table = np.array([_char_flags(chr(i)) for i in range(_BMP)], dtype=np.uint8)
+
+    if len(codes) == 0 or codes.max() < _BMP:
+        return _table[codes]
+    flags = _table[np.minimum(codes, _BMP - 1)]
+    high = codes >= _BMP
+    unique, inverse = np.unique(codes[high], return_inverse=True)
+    flags[high] = np.array([_char_flags(chr(c)) for c in unique], dtype=np.uint8)[inverse]
+    return flags
+
+
+def text_features(texts: list[str]) -> dict[str, np.ndarray]:
+    """
+    Compute the text features of all pages in one vectorized pass over the code points
+    of the concatenated texts.
+
+    Args:
+        texts: extracted text of every page
+    Returns:
+        dict[str, np.ndarray]: feature name -> array with one value per page:
+        - special_char_ratio: share of characters that are not alphanumeric
+        - word_length_variance: population variance of the word lengths
+        - line_count: number of newlines
+        - formula_density: share of non-space characters that are math symbols
+        - bullet_ratio: share of non-empty lines starting with a bullet or enumeration
+        - table_ratio: share of non-empty lines with at least two column gaps
+        - digit_ratio: share of non-space characters that are digits
+    """
+    n_pages = len(texts)
+    lengths = np.array([len(t) for t in texts], dtype=np.int64)
+    if n_pages == 0 or lengths.sum() == 0:
+        return {name: np.zeros(n_pages) for name in (
+            "special_char_ratio", "word_length_variance", "line_count",
+            "formula_density", "bullet_ratio", "table_ratio", "digit_ratio"
+        )}
+
+    # Every page is terminated by a newline so that no word or line spans two pages
+    # and no page segment is empty. The separator is subtracted from the counts.
+    codes = np.frombuffer(("\n".join(texts) + "\n").encode("utf-32-le"), dtype=np.uint32)
+    page_starts = np.concatenate([[0], np.cumsum(lengths + 1)[:-1]])
+
+    flags = _classify(codes)
+    space = (flags & _SPACE).astype(bool)
+    newline = codes == ord("\n")
+
+    def per_page(mask: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(mask.astype(np.int64), page_starts).astype(float)
+
+    safe_lengths = np.maximum(lengths, 1)
+    non_space = per_page(~space)
+    safe_non_space = np.maximum(non_space, 1)
+
+    features = {
+        "special_char_ratio": (per_page(~(flags & _ALNUM).astype(bool)) - 1) / safe_lengths,
+        "line_count": per_page(newline) - 1,
+        "formula_density": per_page((flags & _MATH).astype(bool) & ~space) / safe_non_space,
+        "digit_ratio": per_page((flags & _DIGIT).astype(bool)) / safe_non_space,
+    }
+
+    # Words are maximal runs of non-space characters (same as str.split)
+    word_char = ~space
+    boundaries = np.diff(word_char.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(boundaries == 1)
+    word_lengths = (np.flatnonzero(boundaries == -1) - starts).astype(float)
+    word_page = np.searchsorted(page_starts, starts, side="right") - 1
+    word_count = np.bincount(word_page, minlength=n_pages).astype(float)
+    safe_word_count = np.maximum(word_count, 1)
+    mean = np.bincount(word_page, weights=word_lengths, minlength=n_pages) / safe_word_count
+    mean_sq = np.bincount(word_page, weights=word_lengths ** 2, minlength=n_pages) / safe_word_count
+    features["word_length_variance"] = np.maximum(mean_sq - mean ** 2, 0.0)
+
+    # Lines: the first non-space character of every line decides if it is a bullet
+    line = np.cumsum(newline) - newline
+    line_page = np.repeat(np.arange(n_pages), per_page(newline).astype(np.int64))
+    content = np.flatnonzero(word_char)
+    content_line = line[content]
+    # Pages of whitespace only have no line with content
+    first = content[np.concatenate([[True], content_line[1:] != content_line[:-1]])] if content.size else content
+    lines_per_page = np.bincount(line_page[line[first]], minlength=n_pages).astype(float)
+    # Enumerations such as "1." or "a)" also count as bullets
+    following = codes[first + 1]
+    enumerated = (flags[first] & _ALNUM).astype(bool) & ((following == ord(".")) | (following == ord(")")))
+    bullet = (flags[first] & _BULLET).astype(bool) | enumerated
+    bullet_lines = np.bincount(line_page[line[first[bullet]]], minlength=n_pages)
+
+    # Column gaps: runs of two or more spaces/tabs after some content of the line
+    blank = (codes == ord(" ")) | (codes == ord("\t"))
+    gap_start = blank[:-1] & blank[1:]
+    gap_start[1:] &= word_char[:-2]
+    gap_start[0] = False
+    gaps_per_line = np.bincount(line[:-1][gap_start], minlength=line[-1] + 1)
+    table_lines = np.bincount(line_page[gaps_per_line >= 2], minlength=n_pages)
+
+    safe_lines = np.maximum(lines_per_page, 1)
+    features["bullet_ratio"] = bullet_lines / safe_lines
+    features["table_ratio"] = table_lines / safe_lines
+
+    for name, values in features.items():
+        features[name] = np.where(lengths > 0, values, 0.0)
+    return features
+
+
+def complexity_scores(
+        texts: list[str],
+        graphics_sizes: list[list[int]] | None = None
+        ) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    Score the content complexity of all pages at once. The score combines the special
+    character ratio, word length variance and line density of the text with the number
+    and size variance of the graphics of each page.
+
+    Args:
+        texts: extracted text of every page
+        graphics_sizes: pixel areas of the graphics of every page
+    Returns:
+        tuple[np.ndarray, dict[str, np.ndarray]]: (complexity score per page in [0, 1],
+        text features per page, see text_features)
+    """
+    n_pages = len(texts)
+    features = text_features(texts)
+    has_text = np.array([bool(t) for t in texts])
+
+    scores = np.where(
+        has_text,
+        np.minimum(0.4, features["special_char_ratio"])
+        + np.minimum(0.3, features["word_length_variance"] / 10)
+        + np.minimum(0.3, features["line_count"] / 50),
+        0.0
+    )
+
+    if graphics_sizes is not None and any(graphics_sizes):
+        counts = np.array([len(sizes) for sizes in graphics_sizes], dtype=float)
+        sizes = np.concatenate([np.asarray(s, dtype=float) for s in graphics_sizes if len(s)])
+        owner = np.repeat(np.arange(n_pages), counts.astype(np.int64))
+        safe_counts = np.maximum(counts, 1)
+        avg_size = np.bincount(owner, weights=sizes, minlength=n_pages) / safe_counts
+        size_var = np.bincount(owner, weights=(sizes - avg_size[owner]) ** 2, minlength=n_pages) / safe_counts
+        scores += np.where(
+            counts > 0,
+            np.minimum(0.3, counts / 10) + np.minimum(0.3, size_var / (avg_size + 1) * 0.1),
+            0.0
+        )
+
+    return np.minimum(1.0, scores), features
@@ -1,17 +1,31 @@
 import PIL
+import hashlib
+import json
 import os
-import openai
 import re
-import streamlit as st
-import pandas as pd
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable
 
-from analyzer import FileAnalyzer
+from document_store import DocumentStore
+from page_cache import select_pages
+from replay import ReplayMissError, create_client
 from structures import FlashCardStruct
-from few_shot_examples import few_shot_examples_gpt4o, few_shot_examples_gpt3o, few_shot_examples_exercises
 from utils import pil_to_base64
 
+# openai, pandas, NumPy (analyzer, layout, router) and the few-shot prompt images are
+# imported on first use to keep the startup of the app and the CLI tools fast
+if TYPE_CHECKING:
+    import pandas as pd
+    from router import RoutingLog
+
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Concurrent requests of one creator in exercise mode
+EXERCISE_WORKERS = int(os.getenv("FLASHCARD_EXERCISE_WORKERS", "4"))
+# Output limit of gpt-4o, the ceiling of the budget of an exercise group
+EXERCISE_MAX_OUTPUT_TOKENS = 16384
 
 class FlashCardCreator:
     """
@@ -24,83 +38,495 @@ class FlashCardCreator:
             chapter: str = "default",
             max_tokens: int = 3000,
             cost_efficient: bool = False,
-            exercise_flashcards: bool = False
+            exercise_flashcards: bool = False,
+            routing_log: "RoutingLog | None" = None,
+            escalate: bool = True,
+            document_store: DocumentStore | None = None,
+            doc_hash: str | None = None,
+            crop_regions: bool = False,
+            client=None,
+            refresh: bool = False
             ):
         """
         Args:
-            pages: list of PIL images
+            pages: list of PIL images or a file-backed PageSequence
             selected_pages: list of indices of the pages to process
             chapter: name of the chapter (usually the file name without the .pdf extension)
-            max_tokens: int of the max tokens to use for the GPT-4o model
+            max_tokens: int of the max tokens per request. In cost-efficient mode each page
+            gets a smaller budget predicted from its analysis, max_tokens is the upper limit
             cost_efficient: bool of whether to perform cost-efficient model selection
             exercise_flashcards: bool of whether to create exercise flashcards
+            routing_log: RoutingLog to record per-page routing outcomes in. Defaults to
+            the default log when cost_efficient is enabled.
+            escalate: bool of whether to retry text-routed pages on GPT-4o with the page
+            image if the text model output fails validation
+            document_store: optional DocumentStore to share analyses and model responses
+            with other sessions processing the same document
+            doc_hash: hash of the document in the document store
+            crop_regions: bool of whether to strip repeated page furniture and crop pages
+            to their content region before sending them to the vision model. Off by
+            default, enable it for slide decks with logos, headers and footers
+            client: OpenAI compatible client. Defaults to the client of the configured
+            API mode (live, record or replay, see replay.create_client)
+            refresh: bool of whether to ignore stored responses and regenerate the
+            flashcards. The new responses replace the stored ones.
         """
         # select the subset of pages to process
-        self.pages = [pages[i] for i in selected_pages]
-        self.client = openai.OpenAI(api_key=OPENAI_API_KEY)
+        self.pages = select_pages(pages, selected_pages)
+        self.selected_pages = list(selected_pages)
+        self.document_store = document_store if doc_hash else None
+        self.doc_hash = doc_hash
+        self.refresh = refresh
+        if crop_regions:
+            from layout import PageLayout
+            self.layout = PageLayout.fit(self.pages)
+        else:
+            self.layout = None
+
+        self.client = client or create_client(OPENAI_API_KEY)
         self.chapter = chapter
         self.max_tokens = max_tokens
         self.exercise_flashcards = exercise_flashcards
+        self._local = threading.local()  # last_completion is kept per thread
+        self._stats_lock = threading.Lock()  # exercise groups run on several threads
+        # Messages of failed API calls. Generation runs on job threads without a
+        # Streamlit script context, so errors are collected and shown by the job.
+        self.errors = []
+        self.page_max_tokens = max_tokens  # max_tokens budget of the current page
+        self.token_stats = {
+            'requests': 0,
+            'truncated': 0,  # responses that hit their max_tokens budget
+            'retries': 0,  # requests repeated with a larger budget
+            'reserved_tokens': 0,  # sum of max_tokens over all requests
+            'completion_tokens': 0  # output tokens actually generated
+        }
+        self.escalate = escalate
+        self.escalation_stats = {
+            'text_pages': 0,  # pages first sent to a tier below the most expensive one
+            'escalated': 0,  # pages retried on the most expensive tier
+            'reasons': {},  # validation failure -> count
+            'extra_latency': 0.0  # seconds spent on escalation calls
+        }
         
         # Only perform analysis if cost_efficient is enabled
         if cost_efficient:
-            analyzer = FileAnalyzer(self.pages, deep_analysis=False)
-            self.analysis = analyzer.analyze()
+            from router import RoutingPolicy
+            self.policy = RoutingPolicy.load()
+            self.analysis = self.__analyze()
+            if routing_log is None:
+                from router import RoutingLog
+                routing_log = RoutingLog()
+            self.routing_log = routing_log
+
+            from token_budget import TokenPredictor
+            self.token_predictor = TokenPredictor.load(max_tokens=max_tokens)
         else:
+            self.token_predictor = None
+            self.policy = None
             self.analysis = None
+            self.routing_log = routing_log
+
+        if exercise_flashcards:
+            self.mode = "exercise"
+        else:
+            self.mode = "cost_efficient" if cost_efficient else "regular"
+        if crop_regions:
+            # Cropped pages give different responses than full pages
+            self.mode += "-cropped"
+
+    @property
+    def last_completion(self) -> dict | None:
+        """
+        Metadata of the most recent API call of the current thread.
+        """
+        return getattr(self._local, 'last_completion', None)
 
-    def create_flashcards(self) -> list[FlashCardStruct]:
+    @last_completion.setter
+    def last_completion(self, value: dict | None):
+        self._local.last_completion = value
+
+    def __analyze(self) -> dict[int, dict]:
+        """
+        Analyze the selected pages, reusing analyses from the document store. The store
+        only holds the text and features of a page; the model is always chosen by the
+        current routing policy, so a refitted policy also applies to stored documents.
+
+        Returns:
+            dict[int, dict]: analysis per index in self.pages (see FileAnalyzer.analyze)
+        """
+        analysis = {}
+        if self.document_store:
+            for idx, page_no in enumerate(self.selected_pages):
+                cached = self.document_store.get_analysis(self.doc_hash, page_no, "basic")
+                if cached is not None:
+                    tier = self.policy.choose(cached['features'])
+                    cached['use_gpt4o'] = tier['input'] == 'image'
+                    cached['model'] = tier['model']
+                    analysis[idx] = cached
+
+        missing = [idx for idx in range(len(self.pages)) if idx not in analysis]
+        if missing:
+            from analyzer import FileAnalyzer
+            analyzer = FileAnalyzer(select_pages(self.pages, missing), deep_analysis=False, policy=self.policy)
+            for pos, result in analyzer.analyze().items():
+                idx = missing[pos]
+                analysis[idx] = result
+                if self.document_store:
+                    stored = {k: v for k, v in result.items() if k not in ('use_gpt4o', 'model')}
+                    self.document_store.put_analysis(self.doc_hash, self.selected_pages[idx], "basic", stored)
+
+        return analysis
+
+    def create_flashcards(
+            self,
+            progress_callback: Callable[[int, int], None] | None = None
+            ) -> list[FlashCardStruct]:
         """
         Create flashcards for the selected pages.
 
+        Args:
+            progress_callback: optional function called with (processed pages, total pages)
+            after each page
+
         Returns:
             list of FlashCardStruct objects
         """
+        if self.exercise_flashcards:
+            return self.__create_exercise_flashcards(progress_callback)
+
         flashcards = []
         questions = []
         answers = []
 
         for idx, page in enumerate(self.pages):
-            if self.exercise_flashcards:
-                response = self.create_exercise_flashcards_gpt4o(page)
+            # Another session may already have processed this page
+            cached = None
+            if self.document_store and not self.refresh:
+                cached = self.document_store.get_response(self.doc_hash, self.selected_pages[idx], self.mode)
+
+            if cached is not None:
+                response = cached
+            elif self.analysis:
+                # If cost_efficient is enabled, use the tier the routing policy chose
+                response = self.__create_flashcards_with_escalation(idx, page)
             else:
-                # If cost_efficient is enabled, use analysis to choose model
-                if self.analysis and self.analysis[idx]['use_gpt4o']:
-                    response = self.create_flashcards_for_page_gpt4o(page)
-                else:
-                    # Use GPT-3.5-turbo by default or when analysis suggests it
-                    if self.analysis:
-                        response = self.create_flashcards_for_page_gpt3o(self.analysis[idx]['text'])
-                    else:
-                        # No analysis available, use GPT-4o for better results
-                        response = self.create_flashcards_for_page_gpt4o(page)
+                # No analysis available, use GPT-4o for better results
+                response = self.create_flashcards_for_page_gpt4o(page)
+
+            # Failed calls return an empty string and are not shared
+            if self.document_store and cached is None and response:
+                self.document_store.put_response(self.doc_hash, self.selected_pages[idx], self.mode, response)
             
             # The response can contain multiple flashcards, so we need to split them
             # since they are separated by <Question> and <Answer> tags
-
             questions.extend(re.findall(r'<Question>(.*?)</Question>', response, re.DOTALL))
             answers.extend(re.findall(r'<Answer>(.*?)</Answer>', response, re.DOTALL))
+
+            if progress_callback:
+                progress_callback(idx + 1, len(self.pages))
         
         for idx, (question, answer) in enumerate(zip(questions, answers)):
             flashcards.append(FlashCardStruct(question, answer, idx, self.chapter))
 
         return flashcards
 
+    def __create_exercise_flashcards(
+            self,
+            progress_callback: Callable[[int, int], None] | None = None
+            ) -> list[FlashCardStruct]:
+        """
+        Create exercise flashcards across pages. All selected pages are indexed first
+        from their text, then the pages of each exercise are grouped with the pages of
+        its solution and every group is sent as one request. Groups are independent,
+        so they run concurrently; the cards keep the page order of the groups.
+
+        Args:
+            progress_callback: optional function called with (processed pages, total pages)
+            after each group
 
-    def create_flashcards_for_page_gpt4o(self, page: PIL.Image.Image):
+        Returns:
+            list of FlashCardStruct objects
+        """
+        from exercises import group_exercise_pages, index_exercise_pages
+
+        texts = self.__page_texts()
+        if texts is None:
+            # Without page texts nothing can be matched, every page is its own group
+            groups = [
+                {"pages": [idx], "exercises": [], "solved": False, "restrict": False, "members": {}}
+                for idx in range(len(self.pages))
+            ]
+        else:
+            groups = group_exercise_pages(index_exercise_pages(texts))
+        done_pages = set()
+        progress_lock = threading.Lock()
+
+        def process(group: dict) -> str:
+            response = self.__create_exercise_group(group)
+            if progress_callback:
+                with progress_lock:
+                    done_pages.update(group['pages'])
+                    progress_callback(len(done_pages), len(self.pages))
+            return response
+
+        with ThreadPoolExecutor(max_workers=EXERCISE_WORKERS, thread_name_prefix="exercise-group") as executor:
+            responses = list(executor.map(process, groups))
+
+        questions = []
+        answers = []
+        for response in responses:
+            questions.extend(re.findall(r'<Question>(.*?)</Question>', response, re.DOTALL))
+            answers.extend(re.findall(r'<Answer>(.*?)</Answer>', response, re.DOTALL))
+
+        return [
+            FlashCardStruct(question, answer, idx, self.chapter)
+            for idx, (question, answer) in enumerate(zip(questions, answers))
+        ]
+
+    def __create_exercise_group(self, group: dict) -> str:
+        """
+        Create the flashcards of one exercise group, reusing the response of the
+        document store if another session already processed the same group.
+
+        Args:
+            group: page group of exercises.group_exercise_pages
+
+        Returns:
+            str: String containing flashcards in <Question> and <Answer> format
+        """
+        page_numbers = [self.selected_pages[idx] for idx in group['pages']]
+        key = json.dumps([page_numbers, group['exercises'], group['restrict'], self.layout is not None])
+        mode = f"exercise-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+
+        if self.document_store and not self.refresh:
+            cached = self.document_store.get_response(self.doc_hash, page_numbers[0], mode)
+            if cached is not None:
+                return cached
+
+        # A group answers several pages at once, so it gets the output budget of all of them
+        max_tokens = min(EXERCISE_MAX_OUTPUT_TOKENS, self.max_tokens * len(group['pages']))
+        response = self.create_exercise_flashcards_gpt4o(
+            [self.pages[idx] for idx in group['pages']],
+            group['exercises'],
+            group['solved'],
+            group['restrict'],
+            max_tokens
+        )
+        truncated = self.last_completion and self.last_completion['finish_reason'] == 'length'
+        if truncated and len(group['exercises']) > 1:
+            # Too many cards for one response, ask for each exercise separately
+            from exercises import split_exercise_group
+            response = "\n".join(self.__create_exercise_group(part) for part in split_exercise_group(group))
+
+        # Failed calls return an empty string and are not shared
+        if self.document_store and response:
+            self.document_store.put_response(self.doc_hash, page_numbers[0], mode, response)
+        return response
+
+    def __page_texts(self) -> list[str] | None:
+        """
+        Text of every selected page for the exercise index. Texts of the cost-efficient
+        analysis and of the document store (including the PDF text layer stored on
+        upload) are reused, the other pages are OCRed concurrently.
+
+        Returns:
+            list[str] | None: text per index in self.pages, None if pages need OCR
+            but Tesseract is not available
+        """
+        texts = {}
+        for idx, page_no in enumerate(self.selected_pages):
+            if self.analysis:
+                texts[idx] = self.analysis[idx]['text']
+            elif self.document_store:
+                for mode in ("text", "basic"):
+                    cached = self.document_store.get_analysis(self.doc_hash, page_no, mode)
+                    if cached is not None:
+                        texts[idx] = cached['text']
+                        break
+
+        def ocr(idx: int) -> str:
+            import pytesseract
+            text = pytesseract.image_to_string(self.pages[idx].convert('L'))
+            if self.document_store:
+                self.document_store.put_analysis(self.doc_hash, self.selected_pages[idx], "text", {"text": text})
+            return text
+
+        # Tesseract runs in a subprocess, so the pages are OCRed in parallel
+        missing = [idx for idx in range(len(self.pages)) if idx not in texts]
+        if missing:
+            try:
+                import pytesseract
+                pytesseract.get_tesseract_version()
+            except (ImportError, EnvironmentError):
+                return None
+            with ThreadPoolExecutor(max_workers=EXERCISE_WORKERS, thread_name_prefix="exercise-index") as executor:
+                texts.update(zip(missing, executor.map(ocr, missing)))
+
+        return [texts[idx] for idx in range(len(self.pages))]
+
+    def __create_flashcards_with_escalation(self, idx: int, page: PIL.Image.Image) -> str:
+        """
+        Create flashcards for a page on the tier the routing policy chose. If the page
+        was routed to a cheaper tier and the output fails validation, the page is
+        retried on the most expensive tier of the policy.
+
+        Args:
+            idx: index of the page in self.pages
+            page: PIL Image object of the page
+
+        Returns:
+            str: String containing flashcards in <Question> and <Answer> format
+        """
+        tiers = self.policy.tiers
+        tier = next((t for t in tiers if t['model'] == self.analysis[idx]['model']), tiers[-1])
+        if tier is tiers[-1]:
+            response = self.__create_flashcards_on_tier(idx, page, tier)
+            self.__record_outcome(idx, response)
+            return response
+
+        self.escalation_stats['text_pages'] += 1
+        response = self.__create_flashcards_on_tier(idx, page, tier)
+        self.__record_outcome(idx, response)
+
+        finish_reason = self.last_completion['finish_reason'] if self.last_completion else None
+        problems = validate_response(response, finish_reason)
+        if not problems or not self.escalate:
+            return response
+
+        self.escalation_stats['escalated'] += 1
+        for problem in problems:
+            self.escalation_stats['reasons'][problem] = self.escalation_stats['reasons'].get(problem, 0) + 1
+
+        escalated = self.__create_flashcards_on_tier(idx, page, tiers[-1])
+        if self.last_completion:
+            self.escalation_stats['extra_latency'] += self.last_completion['latency']
+        self.__record_outcome(idx, escalated)
+
+        # Keep the cheaper tier's output if the escalation call failed entirely
+        return escalated or response
+
+    def __create_flashcards_on_tier(self, idx: int, page: PIL.Image.Image, tier: dict) -> str:
+        """
+        Create flashcards for a page with the model of a routing tier, from the OCR text
+        or the page image depending on the tier's input.
+        """
+        if tier['input'] == 'text':
+            # Reserve only the output tokens this page is expected to need. Image requests
+            # keep the fixed budget, the predictor is fitted on text features only.
+            if self.token_predictor:
+                self.page_max_tokens = self.token_predictor.budget(self.analysis[idx]['features'])
+            # A truncated response of a cheaper tier is escalated right away instead of
+            # first climbing the retry ladder of _chat
+            retry = not self.escalate or tier is self.policy.tiers[-1]
+            return self.create_flashcards_for_page_gpt3o(self.analysis[idx]['text'], tier['model'], retry_truncated=retry)
+        return self.create_flashcards_for_page_gpt4o(page, tier['model'])
+
+    def __record_outcome(self, idx: int, response: str):
+        """
+        Record the outcome of the last API call for a page in the routing log.
+        """
+        if not (self.routing_log and self.analysis and self.last_completion):
+            return
+        self.routing_log.record(
+            self.analysis[idx]['features'],
+            self.last_completion['model'],
+            card_count=count_flashcards(response),
+            truncated=self.last_completion['finish_reason'] == 'length',
+            total_tokens=self.last_completion['total_tokens'],
+            completion_tokens=self.last_completion['completion_tokens']
+        )
+
+    def __image_part(self, page: PIL.Image.Image) -> dict:
+        """
+        Build the image message part of a page. With crop_regions enabled, repeated
+        page furniture is removed and the page is cropped to its content.
+
+        Args:
+            page: PIL Image object of the page
+
+        Returns:
+            dict: image_url message part
+        """
+        if self.layout:
+            page = self.layout.crop(page)
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": pil_to_base64(page)
+            }
+        }
+
+    def _chat(
+            self,
+            model: str,
+            messages: list[dict],
+            retry_truncated: bool = True,
+            max_tokens: int | None = None) -> str:
+        """
+        Send a chat completion request and remember its metadata in last_completion.
+        The request uses the max_tokens budget of the current page. If the response is
+        truncated, it is retried with twice the budget up to max_tokens.
+
+        Args:
+            model: name of the OpenAI model
+            messages: list of chat messages
+            retry_truncated: bool of whether to retry truncated responses
+            max_tokens: budget of a request covering several pages, replaces both the
+            page budget and the max_tokens limit
+
+        Returns:
+            str: content of the response
+        """
+        self.last_completion = None
+        limit = max_tokens or self.max_tokens
+        budget = max_tokens or self.page_max_tokens
+        total_tokens = 0
+        start = time.perf_counter()
+        while True:
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=budget
+            )
+            choice = response.choices[0]
+            completion_tokens = response.usage.completion_tokens if response.usage else 0
+            total_tokens += response.usage.total_tokens if response.usage else 0
+
+            with self._stats_lock:
+                self.token_stats['requests'] += 1
+                self.token_stats['reserved_tokens'] += budget
+                self.token_stats['completion_tokens'] += completion_tokens
+                if choice.finish_reason == 'length':
+                    self.token_stats['truncated'] += 1
+            if choice.finish_reason != 'length' or budget >= limit or not retry_truncated:
+                break
+            budget = min(limit, budget * 2)
+            with self._stats_lock:
+                self.token_stats['retries'] += 1
+
+        self.last_completion = {
+            'model': model,
+            'finish_reason': choice.finish_reason,
+            'total_tokens': total_tokens,
+            'completion_tokens': completion_tokens,
+            'max_tokens': budget,
+            'latency': time.perf_counter() - start
+        }
+        return choice.message.content
+
+    def create_flashcards_for_page_gpt4o(self, page: PIL.Image.Image, model: str = "gpt-4o"):
         """
         Create flashcards for a single page.
         
         Args:
             page: PIL Image object of the page to process
+            model: vision capable model to use
             
         Returns:
             str: String containing flashcards in <Question> and <Answer> format
         """
-        # Convert PIL Image to base64
-        img_str = pil_to_base64(page)
-        
         # Create the message for GPT-4 Vision using few-shot examples
+        from few_shot_examples import few_shot_examples_gpt4o
         messages = few_shot_examples_gpt4o.copy()  # Start with the few-shot examples
         
         # Add the current page to process
@@ -111,39 +537,40 @@ class FlashCardCreator:
                     "type": "text",
                     "text": "Create flashcards from this page following the same format as the examples."
                 },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": img_str
-                    }
-                }
+                self.__image_part(page)
             ]
         })
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=self.max_tokens
-            )
-            
-            # Return the raw response text which should contain <Question> and <Answer> tags
-            return response.choices[0].message.content
+            # Return the raw response text which should contain <Question> and <Answer> tags.
+            # A retry would resend the page image, so the request gets the full budget.
+            return self._chat(model, messages, retry_truncated=False, max_tokens=self.max_tokens)
             
+        except ReplayMissError:
+            # A replay run must fail loudly instead of producing empty output
+            raise
         except Exception as e:
-            st.error(f"Error creating flashcards: {str(e)}")
+            self.errors.append(str(e))
             return ""
 
-    def create_flashcards_for_page_gpt3o(self, text:str):
+    def create_flashcards_for_page_gpt3o(
+            self,
+            text: str,
+            model: str = "gpt-3.5-turbo",
+            retry_truncated: bool = True):
         """
         Create flashcards for a single page using GPT-3.5-turbo.
 
         Args:
             text: str of the text to process
+            model: text model to use
+            retry_truncated: bool of whether to retry a truncated response with a
+            larger budget
 
         Returns:
             str: String containing flashcards in <Question> and <Answer> format
         """
+        from few_shot_examples import few_shot_examples_gpt3o
         messages = few_shot_examples_gpt3o.copy()
         messages.append({
             "role": "user",
@@ -160,52 +587,113 @@ class FlashCardCreator:
         })
 
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=self.max_tokens
-            )
-            return response.choices[0].message.content
+            return self._chat(model, messages, retry_truncated)
+        except ReplayMissError:
+            # A replay run must fail loudly instead of producing empty output
+            raise
         except Exception as e:
-            st.error(f"Error creating flashcards: {str(e)}")
+            self.errors.append(str(e))
             return ""
 
-    def create_exercise_flashcards_gpt4o(self, page: PIL.Image.Image):
+    def create_exercise_flashcards_gpt4o(
+            self,
+            pages: list[PIL.Image.Image],
+            exercises: list[str] | None = None,
+            solved: bool = False,
+            restrict: bool = False,
+            max_tokens: int | None = None):
         """
-        Create exercise flashcards for a single page.
+        Create exercise flashcards from a group of pages in one request.
+
+        Args:
+            pages: PIL Image objects of the question and solution pages
+            exercises: ids of the exercises on the pages, if known
+            solved: bool of whether the pages contain the solutions of the exercises
+            restrict: bool of whether to create flashcards only for the listed
+            exercises, used when a page is shared with another group
+            max_tokens: output budget of the request, defaults to the page budget
+
+        Returns:
+            str: String containing flashcards in <Question> and <Answer> format
         """
-        img_str = pil_to_base64(page)
+        instruction = "Create exercise flashcards from these pages following the same format as the examples."
+        if exercises and solved:
+            instruction += (
+                f" The pages contain exercise(s) {', '.join(exercises)} and their solutions,"
+                " answer each question with its given solution."
+            )
+        if exercises and restrict:
+            instruction += f" Only create flashcards for exercise(s) {', '.join(exercises)}."
 
+        from few_shot_examples import few_shot_examples_exercises
         messages = few_shot_examples_exercises.copy()
         messages.append({
             "role": "user",
             "content": [
                 {
                     "type": "text",
-                    "text": "Create exercise flashcards from these pages following the same format as the examples."
+                    "text": instruction
                 },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": img_str
-                    }
-                }
+                *[self.__image_part(page) for page in pages]
             ]
         })
 
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=self.max_tokens
-            )
-            return response.choices[0].message.content
+            return self._chat("gpt-4o", messages, max_tokens=max_tokens)
+        except ReplayMissError:
+            # A replay run must fail loudly instead of producing empty output
+            raise
         except Exception as e:
-            st.error(f"Error creating exercise flashcards: {str(e)}")
+            self.errors.append(str(e))
             return ""
 
+def count_flashcards(response: str) -> int:
+    """
+    Count the complete <Question>/<Answer> pairs in a model response.
+    Args:
+        response: raw model response
+    Returns:
+        int: number of flashcards
+    """
+    return min(
+        len(re.findall(r'<Question>(.*?)</Question>', response, re.DOTALL)),
+        len(re.findall(r'<Answer>(.*?)</Answer>', response, re.DOTALL))
+    )
+
+
+def validate_response(
+        response: str,
+        finish_reason: str | None = None,
+        min_cards: int = 1) -> list[str]:
+    """
+    Check a model response for problems that warrant a retry on a stronger model.
+    Args:
+        response: raw model response
+        finish_reason: finish reason reported by the API
+        min_cards: minimum number of flashcards expected for the page
+    Returns:
+        list[str]: names of the failed checks, empty if the response is fine
+    """
+    problems = []
+    if finish_reason == 'length':
+        problems.append('truncated')
+
+    tags = ('<Question>', '</Question>', '<Answer>', '</Answer>')
+    if len({response.count(tag) for tag in tags}) > 1:
+        problems.append('unbalanced_tags')
+
+    answers = re.findall(r'<Answer>(.*?)</Answer>', response, re.DOTALL)
+    if any(not answer.strip() for answer in answers):
+        problems.append('empty_answer')
+
+    if count_flashcards(response) < min_cards:
+        problems.append('too_few_cards')
+
+    return problems
+
+
 def flashcard_struct_to_df(
-        flashcards: list[FlashCardStruct]) -> pd.DataFrame:
+        flashcards: list[FlashCardStruct]) -> "pd.DataFrame":
     """
     Convert a list of FlashCardStruct to a DataFrame.
     Args:
@@ -213,6 +701,8 @@ def flashcard_struct_to_df(
     Returns:
         pd.DataFrame: DataFrame with the flashcards
     """
+    import pandas as pd
+
     questions = [flashcard.question for flashcard in flashcards]
     answers = [flashcard.answer for flashcard in flashcards]
 
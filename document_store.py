@@ -0,0 +1,347 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+import PIL
+
+from page_cache import PageSequence, get_page_cache
+
+
+DEFAULT_STORE_PATH = Path(os.getenv("FLASHCARD_STORE_DIR", "document_store"))
+DEFAULT_MAX_BYTES = int(os.getenv("FLASHCARD_STORE_MAX_MB", "2048")) * 1024 * 1024
+# Documents used within this window are never evicted, since open sessions still
+# read their pages
+DEFAULT_GRACE_SECONDS = float(os.getenv("FLASHCARD_STORE_GRACE_MIN", "60")) * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_hash    text primary key,
+    last_access real not null
+);
+CREATE TABLE IF NOT EXISTS entries (
+    doc_hash    text not null,
+    kind        text not null,      -- pages, analysis, response
+    key         text not null,
+    size        integer not null,
+    primary key (doc_hash, kind, key)
+);
+"""
+
+
+def document_hash(pdf_bytes: bytes) -> str:
+    """
+    Content hash identifying a PDF in the document store.
+
+    Args:
+        pdf_bytes: raw bytes of the PDF
+    Returns:
+        str: hex SHA-256 of the content
+    """
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def _atomic_write(path: Path, data: bytes):
+    """
+    Write a file so that concurrent readers either see the old or the full new content.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+class DocumentStore:
+    """
+    Server-side store for rasterized pages, page analyses and generated flashcards,
+    keyed by the content hash of the PDF. Sessions that upload the same lecture share
+    the renders and the API results, so the second request for a page is served from
+    disk. Files are written atomically and the index lives in SQLite, so the store can
+    be used from several Streamlit sessions and processes at once. When the store
+    grows beyond max_bytes, the least recently used documents are evicted as a whole.
+    Documents that are leased by a running job or were used within the grace window
+    are never evicted, so pages held by other sessions stay readable.
+    """
+    def __init__(
+            self,
+            root: str | Path = DEFAULT_STORE_PATH,
+            max_bytes: int = DEFAULT_MAX_BYTES,
+            grace_seconds: float = DEFAULT_GRACE_SECONDS):
+        """
+        Args:
+            root: directory of the store
+            max_bytes: size limit of all stored files in bytes
+            grace_seconds: documents accessed more recently than this are kept
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self._leases = Counter()  # doc_hash -> number of active leases in this process
+        self._locks = {}  # doc_hash -> lock, so one process renders a document once
+        self._locks_lock = threading.Lock()
+
+        with self.__connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def __connect(self):
+        """
+        Open a short-lived connection, commit on success and always close it.
+        """
+        conn = sqlite3.connect(self.root / "index.db", timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def __doc_lock(self, doc_hash: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(doc_hash, threading.Lock())
+
+    def __path(self, doc_hash: str, kind: str, key: str) -> Path:
+        return self.root / doc_hash / kind / key
+
+    def touch(self, doc_hash: str):
+        """
+        Mark a document as used, e.g. on every rerun of a session that shows it.
+        """
+        self.__touch(doc_hash)
+
+    @contextmanager
+    def lease(self, doc_hash: str):
+        """
+        Protect a document from eviction while a job works on its pages.
+
+        Args:
+            doc_hash: document hash
+        """
+        with self._locks_lock:
+            self._leases[doc_hash] += 1
+        self.__touch(doc_hash)
+        try:
+            yield
+        finally:
+            with self._locks_lock:
+                self._leases[doc_hash] -= 1
+                if not self._leases[doc_hash]:
+                    del self._leases[doc_hash]
+
+    def __touch(self, doc_hash: str):
+        with self.__connect() as conn:
+            conn.execute(
+                "INSERT INTO documents VALUES (?, ?) "
+                "ON CONFLICT(doc_hash) DO UPDATE SET last_access = excluded.last_access",
+                (doc_hash, time.time())
+            )
+
+    def __has(self, doc_hash: str, kind: str, key: str) -> bool:
+        with self.__connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM entries WHERE doc_hash = ? AND kind = ? AND key = ?",
+                (doc_hash, kind, key)
+            ).fetchone()
+        return row is not None
+
+    def __register(self, doc_hash: str, kind: str, key: str, size: int):
+        with self.__connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (doc_hash, kind, key, size)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?)", (doc_hash, time.time())
+            )
+        self.evict(keep=doc_hash)
+
+    def __get_json(self, doc_hash: str, kind: str, key: str):
+        if not self.__has(doc_hash, kind, key):
+            return None
+        try:
+            value = json.loads(self.__path(doc_hash, kind, f"{key}.json").read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            # Evicted by another session in the meantime
+            return None
+        self.__touch(doc_hash)
+        return value
+
+    def __put_json(self, doc_hash: str, kind: str, key: str, value):
+        data = json.dumps(value).encode("utf-8")
+        _atomic_write(self.__path(doc_hash, kind, f"{key}.json"), data)
+        self.__register(doc_hash, kind, key, len(data))
+
+    def get_pages(self, doc_hash: str, dpi: int) -> PageSequence | None:
+        """
+        Get the rasterized pages of a document. Pages stay on disk and are decoded
+        on access.
+
+        Returns:
+            PageSequence | None: the pages, or None if they are not stored
+        """
+        key = str(dpi)
+        if not self.__has(doc_hash, "pages", key):
+            return None
+        page_dir = self.__path(doc_hash, "pages", key)
+        try:
+            count = int((page_dir / "count").read_text())
+        except FileNotFoundError:
+            return None
+        self.__touch(doc_hash)
+        return PageSequence([page_dir / f"{i}.png" for i in range(count)])
+
+    def put_pages(self, doc_hash: str, dpi: int, pages: list[PIL.Image.Image | Path]):
+        """
+        Store the rasterized pages of a document.
+
+        Args:
+            doc_hash: document hash
+            dpi: resolution of the render
+            pages: PIL images, or paths of PNG files that are moved into the store
+        """
+        key = str(dpi)
+        page_dir = self.__path(doc_hash, "pages", key)
+        page_dir.mkdir(parents=True, exist_ok=True)
+        size = 0
+        for i, page in enumerate(pages):
+            path = page_dir / f"{i}.png"
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            if isinstance(page, PIL.Image.Image):
+                page.save(tmp_path, format="PNG")
+            else:
+                shutil.move(page, tmp_path)
+            os.replace(tmp_path, path)
+            size += path.stat().st_size
+        # The count file is written last, it marks the pages as complete
+        _atomic_write(page_dir / "count", str(len(pages)).encode())
+        self.__register(doc_hash, "pages", key, size)
+
+    def pages(
+            self,
+            pdf_bytes: bytes,
+            dpi: int,
+            render: Callable[[bytes, int], list[PIL.Image.Image | Path]]
+            ) -> tuple[str, PageSequence]:
+        """
+        Get the rasterized pages of a PDF, rendering and storing them on a miss.
+        Concurrent sessions requesting the same document wait for a single render.
+
+        Args:
+            pdf_bytes: raw bytes of the PDF
+            dpi: resolution of the render
+            render: function rendering (pdf_bytes, dpi) to a list of PIL images or
+            paths of PNG files
+        Returns:
+            tuple[str, PageSequence]: (document hash, pages)
+        """
+        doc_hash = document_hash(pdf_bytes)
+        with self.__doc_lock(doc_hash):
+            pages = self.get_pages(doc_hash, dpi)
+            if pages is None:
+                self.put_pages(doc_hash, dpi, render(pdf_bytes, dpi))
+                pages = self.get_pages(doc_hash, dpi)
+        return doc_hash, pages
+
+    def get_analysis(self, doc_hash: str, page: int, mode: str) -> dict | None:
+        """
+        Load the FileAnalyzer result of a page.
+
+        Args:
+            doc_hash: document hash
+            page: page index in the document
+            mode: analysis mode, e.g. "basic" or "deep"
+        Returns:
+            dict | None: the analysis, or None if it is not stored
+        """
+        return self.__get_json(doc_hash, "analysis", f"{mode}-{page}")
+
+    def put_analysis(self, doc_hash: str, page: int, mode: str, analysis: dict):
+        """
+        Store the FileAnalyzer result of a page.
+        """
+        self.__put_json(doc_hash, "analysis", f"{mode}-{page}", analysis)
+
+    def get_response(self, doc_hash: str, page: int, mode: str) -> str | None:
+        """
+        Load the model response generated for a page.
+
+        Args:
+            doc_hash: document hash
+            page: page index in the document
+            mode: generation mode, e.g. "regular", "cost_efficient" or "exercise"
+        Returns:
+            str | None: the response, or None if it is not stored
+        """
+        return self.__get_json(doc_hash, "response", f"{mode}-{page}")
+
+    def put_response(self, doc_hash: str, page: int, mode: str, response: str):
+        """
+        Store the model response generated for a page.
+        """
+        self.__put_json(doc_hash, "response", f"{mode}-{page}", response)
+
+    def evict(self, keep: str | None = None):
+        """
+        Remove least recently used documents until the store fits into max_bytes.
+        Leased documents and documents used within the grace window are skipped, so
+        the store can temporarily stay above max_bytes.
+
+        Args:
+            keep: hash of a document that must not be evicted, e.g. the one just written
+        """
+        with self._locks_lock:
+            protected = set(self._leases)
+        if keep:
+            protected.add(keep)
+        cutoff = time.time() - self.grace_seconds
+
+        with self.__connect() as conn:
+            total = conn.execute("SELECT coalesce(sum(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            documents = conn.execute(
+                "SELECT d.doc_hash, coalesce(sum(e.size), 0) FROM documents d "
+                "LEFT JOIN entries e ON e.doc_hash = d.doc_hash "
+                "WHERE d.last_access < ? "
+                "GROUP BY d.doc_hash ORDER BY d.last_access",
+                (cutoff,)
+            ).fetchall()
+
+            evicted = []
+            for doc_hash, size in documents:
+                if total <= self.max_bytes:
+                    break
+                if doc_hash in protected:
+                    continue
+                conn.execute("DELETE FROM entries WHERE doc_hash = ?", (doc_hash,))
+                conn.execute("DELETE FROM documents WHERE doc_hash = ?", (doc_hash,))
+                evicted.append(doc_hash)
+                total -= size
+
+        # Remove files only after the index no longer points to them, and drop the
+        # decoded pages so the page cache does not keep serving deleted documents
+        for doc_hash in evicted:
+            get_page_cache().discard(list((self.root / doc_hash).rglob("*.png")))
+            shutil.rmtree(self.root / doc_hash, ignore_errors=True)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_document_store() -> DocumentStore:
+    """
+    Get the process-wide document store, creating it on first use.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DocumentStore()
+        return _store
@@ -0,0 +1,163 @@
+import re
+
+
+# Markers are only recognized at the start of a line, so references such as
+# "as in Exercise 3" inside running text do not create a match
+_EXERCISE_LABEL = r"(?:exercise|problem|task|aufgabe|übung|ubung)"
+_SOLUTION_LABEL = r"(?:solution|lösung|losung|answer|antwort)"
+_NUMBER = r"#?\s*(\d+(?:[.\-]\d+)*[a-z]?)\b"
+
+_SOLUTION_MARKER = re.compile(
+    rf"^\W*{_SOLUTION_LABEL}s?\s*(?:to|for|of|zu|zur)?\s*(?:{_EXERCISE_LABEL}\s*)?(?:no\.?|nr\.?)?\s*{_NUMBER}",
+    re.IGNORECASE
+)
+_EXERCISE_MARKER = re.compile(rf"^\W*{_EXERCISE_LABEL}\s*(?:no\.?|nr\.?)?\s*{_NUMBER}", re.IGNORECASE)
+_SOLUTION_HEADING = re.compile(rf"^\W*{_SOLUTION_LABEL}(?:s|en)?\W*$", re.IGNORECASE)
+_EXERCISE_HEADING = re.compile(rf"^\W*{_EXERCISE_LABEL}(?:s|n|en)?\W*$", re.IGNORECASE)
+
+
+def normalize_exercise_id(number: str) -> str:
+    """
+    Normalize an exercise number, so that "3.2", "3-2" and the sub-task "3.2b"
+    all refer to the same exercise.
+
+    Args:
+        number: exercise number as found on the page
+    Returns:
+        str: normalized exercise id
+    """
+    return re.sub(r"[a-z]$", "", number.lower()).replace("-", ".").rstrip(".")
+
+
+def index_exercise_pages(texts: list[str]) -> list[dict]:
+    """
+    Find the exercises and solutions on each page from its text.
+
+    A numbered solution marker ("Solution 3.2", "Lösung zu Aufgabe 3") always marks a
+    solution. A numbered exercise marker marks a question, unless it follows a
+    "Solutions" heading, which starts a solution section that lasts until the next
+    "Exercises" heading. Within a solution section, an exercise marker only marks a
+    solution if the exercise was already asked; otherwise the next exercise sheet has
+    started and the section ends. Pages without any marker continue the last exercise
+    of the previous page.
+
+    Args:
+        texts: text of each page in page order
+    Returns:
+        list[dict]: per page, the exercise ids of its "questions" and "solutions"
+    """
+    index = []
+    in_solutions = False
+    last = None  # (role, exercise id) of the last marker seen
+    asked = set()  # exercise ids with a question
+
+    for text in texts:
+        entry = {"questions": [], "solutions": []}
+        for line in text.splitlines():
+            if _EXERCISE_HEADING.match(line):
+                in_solutions = False
+                continue
+            if _SOLUTION_HEADING.match(line):
+                in_solutions = True
+                continue
+            if match := _SOLUTION_MARKER.match(line):
+                last = ("solutions", normalize_exercise_id(match.group(1)))
+            elif match := _EXERCISE_MARKER.match(line):
+                exercise = normalize_exercise_id(match.group(1))
+                in_solutions = in_solutions and exercise in asked
+                last = ("solutions" if in_solutions else "questions", exercise)
+            else:
+                continue
+            if last[0] == "questions":
+                asked.add(last[1])
+            if last[1] not in entry[last[0]]:
+                entry[last[0]].append(last[1])
+
+        if not entry["questions"] and not entry["solutions"] and last:
+            entry[last[0]].append(last[1])
+        index.append(entry)
+
+    return index
+
+
+def group_exercise_pages(index: list[dict], max_pages: int = 4) -> list[dict]:
+    """
+    Group the pages of each exercise with the pages of its solution, so that one
+    request sees both. Exercises sharing a page are merged into one group as long
+    as the group stays within max_pages. Pages without any exercise form a group
+    of their own.
+
+    Args:
+        index: page index of index_exercise_pages
+        max_pages: maximum number of pages of a merged group. A single exercise
+        spanning more pages is never split.
+    Returns:
+        list[dict]: groups ordered by their first page, each with the page indices
+        ("pages"), exercise ids ("exercises"), whether a solution page was found
+        ("solved"), whether the request must be restricted to the listed exercises
+        because one of its pages is also part of another group ("restrict") and the
+        pages and solution state of each exercise ("members", see split_exercise_group)
+    """
+    exercise_pages = {}  # exercise id -> page indices, in order of first appearance
+    solved = set()
+    for page, entry in enumerate(index):
+        for exercise in entry["questions"] + entry["solutions"]:
+            exercise_pages.setdefault(exercise, set()).add(page)
+        solved.update(entry["solutions"])
+
+    groups = []
+    for exercise, pages in sorted(exercise_pages.items(), key=lambda item: min(item[1])):
+        for group in groups:
+            if group["pages"] & pages and len(group["pages"] | pages) <= max_pages:
+                group["pages"] |= pages
+                group["exercises"].append(exercise)
+                break
+        else:
+            groups.append({"pages": set(pages), "exercises": [exercise]})
+
+    covered = set().union(*(group["pages"] for group in groups))
+    groups.extend({"pages": {page}, "exercises": []} for page in range(len(index)) if page not in covered)
+
+    usage = {}
+    for group in groups:
+        for page in group["pages"]:
+            usage[page] = usage.get(page, 0) + 1
+
+    return [
+        {
+            "pages": sorted(group["pages"]),
+            "exercises": group["exercises"],
+            "solved": any(exercise in solved for exercise in group["exercises"]),
+            "restrict": any(usage[page] > 1 for page in group["pages"]),
+            "members": {
+                exercise: {"pages": sorted(exercise_pages[exercise]), "solved": exercise in solved}
+                for exercise in group["exercises"]
+            }
+        }
+        for group in sorted(groups, key=lambda group: min(group["pages"]))
+    ]
+
+
+def split_exercise_group(group: dict) -> list[dict]:
+    """
+    Split a group into one group per exercise, e.g. when the response of the whole
+    group did not fit into the output limit. Each part keeps the pages of its
+    exercise and its solution and is restricted to its exercise.
+
+    Args:
+        group: group of group_exercise_pages
+    Returns:
+        list[dict]: one group per exercise, just the group if it has at most one
+    """
+    if len(group["exercises"]) <= 1:
+        return [group]
+    return [
+        {
+            "pages": member["pages"],
+            "exercises": [exercise],
+            "solved": member["solved"],
+            "restrict": True,
+            "members": {exercise: member}
+        }
+        for exercise, member in group["members"].items()
+    ]
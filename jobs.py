@@ -0,0 +1,235 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+import PIL
+
+from creator import FlashCardCreator
+from structures import FlashCardStruct
+
+
+DEFAULT_DB_PATH = Path(os.getenv("FLASHCARD_JOBS_DB", "jobs.db"))
+DEFAULT_WORKERS = int(os.getenv("FLASHCARD_WORKERS", "2"))
+# Finished jobs and their results are deleted after this many hours
+DEFAULT_RETENTION_SECONDS = float(os.getenv("FLASHCARD_JOBS_RETENTION_HOURS", "24")) * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          text primary key,
+    status      text not null,      -- queued, running, done, failed
+    chapter     text not null,
+    progress    integer not null,
+    total       integer not null,
+    created     real not null,
+    finished    real,
+    error       text,
+    result      text,               -- JSON list of flashcards
+    stats       text,               -- JSON escalation and token stats and errors of the creator
+    owner       integer             -- pid of the process running the job
+);
+"""
+
+
+def _process_alive(pid: int | None) -> bool:
+    """
+    Whether a process with the given id is running on this machine.
+    """
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Process-wide background queue for flashcard generation. Jobs run on a shared
+    thread pool, so Streamlit reruns neither cancel nor repeat a running job, and
+    all browser sessions share the same workers and therefore the same API budget.
+    Job state, progress and results are kept in a SQLite table, the UI only polls it.
+    """
+    def __init__(
+            self,
+            db_path: str | Path = DEFAULT_DB_PATH,
+            max_workers: int = DEFAULT_WORKERS,
+            retention_seconds: float = DEFAULT_RETENTION_SECONDS):
+        """
+        Args:
+            db_path: path of the SQLite job table
+            max_workers: number of jobs that run at the same time
+            retention_seconds: finished jobs older than this are deleted
+        """
+        self.db_path = Path(db_path)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="flashcard-job")
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+
+        with self.__connect() as conn:
+            conn.executescript(_SCHEMA)
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if "owner" not in columns:
+                # Tables created before jobs recorded their process
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner integer")
+
+            # Jobs whose process is gone can never finish. Jobs of other live
+            # processes sharing the table are left alone.
+            unfinished = conn.execute(
+                "SELECT id, owner FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+            orphaned = [(time.time(), row["id"]) for row in unfinished if not _process_alive(row["owner"])]
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', error = 'interrupted', finished = ? WHERE id = ?",
+                orphaned
+            )
+        self.prune()
+
+    def prune(self):
+        """
+        Delete finished jobs older than the retention period, including their results.
+        """
+        with self._lock, self.__connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                (time.time() - self.retention_seconds,)
+            )
+
+    @contextmanager
+    def __connect(self):
+        """
+        Open a short-lived connection, commit on success and always close it.
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def __update(self, job_id: str, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self.__connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def submit(
+            self,
+            pages: list[PIL.Image.Image],
+            selected_pages: list[int],
+            chapter: str = "default",
+            **creator_kwargs) -> str:
+        """
+        Queue a flashcard generation job.
+
+        Args:
+            pages: list of PIL images
+            selected_pages: list of indices of the pages to process
+            chapter: name of the chapter
+            creator_kwargs: further keyword arguments of FlashCardCreator
+        Returns:
+            str: id of the job
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock, self.__connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, chapter, progress, total, created, owner) "
+                "VALUES (?, 'queued', ?, 0, ?, ?, ?)",
+                (job_id, chapter, len(selected_pages), time.time(), os.getpid())
+            )
+        self.executor.submit(self.__run, job_id, pages, selected_pages, chapter, creator_kwargs)
+        self.prune()
+        return job_id
+
+    def __run(self, job_id, pages, selected_pages, chapter, creator_kwargs):
+        self.__update(job_id, status="running")
+        store = creator_kwargs.get("document_store")
+        doc_hash = creator_kwargs.get("doc_hash")
+        try:
+            # Keep the pages of the document on disk until the job is done
+            with store.lease(doc_hash) if store and doc_hash else nullcontext():
+                creator = FlashCardCreator(pages, selected_pages, chapter, **creator_kwargs)
+                flashcards = creator.create_flashcards(
+                    progress_callback=lambda done, total: self.__update(job_id, progress=done)
+                )
+            stats = json.dumps({
+                "escalation": creator.escalation_stats,
+                "tokens": creator.token_stats,
+                "errors": creator.errors
+            })
+            if creator.errors and not flashcards:
+                # Every request failed, e.g. a missing API key or a rate limit
+                self.__update(
+                    job_id, status="failed", finished=time.time(), error=f"all {len(creator.errors)} request(s) failed: {creator.errors[0]}", stats=stats
+                )
+                return
+            result = [
+                {"question": f.question, "answer": f.answer, "id": f.id, "chapter": f.chapter}
+                for f in flashcards
+            ]
+            self.__update(
+                job_id, status="done", progress=len(selected_pages), finished=time.time(),
+                result=json.dumps(result), stats=stats
+            )
+        except Exception as e:
+            self.__update(job_id, status="failed", finished=time.time(), error=str(e))
+
+    def status(self, job_id: str) -> dict | None:
+        """
+        Get the state of a job.
+
+        Returns:
+            dict | None: status, chapter, progress, total, error, escalation and token stats,
+            errors of failed requests and timestamps of the job, or None if the job does not exist
+        """
+        with self.__connect() as conn:
+            row = conn.execute(
+                "SELECT id, status, chapter, progress, total, created, finished, error, stats "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status = dict(row)
+        status["stats"] = json.loads(status["stats"]) if status["stats"] else None
+        return status
+
+    def result(self, job_id: str) -> list[FlashCardStruct] | None:
+        """
+        Get the flashcards of a finished job.
+
+        Returns:
+            list[FlashCardStruct] | None: the flashcards, or None if the job is not done
+        """
+        with self.__connect() as conn:
+            row = conn.execute(
+                "SELECT result FROM jobs WHERE id = ? AND status = 'done'", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return [
+            FlashCardStruct(f["question"], f["answer"], f["id"], f["chapter"])
+            for f in json.loads(row["result"])
+        ]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Get the process-wide job queue, creating it on first use.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,141 @@
+import numpy as np
+import PIL
+from PIL import Image
+
+
+class PageLayout:
+    """
+    Detect the content region of pages and the page furniture (logos, slide numbers,
+    headers and footers) that repeats across a deck, so that only the content is sent
+    to the vision model. Fewer pixels per request means fewer vision tokens and
+    smaller uploads.
+
+    Furniture is learned on a coarse grid: every page is reduced to a grid of cells and
+    a cell in the outer bands of the page counts as furniture if it contains the same
+    ink on at least furniture_ratio of the pages. Furniture cells are painted with the background
+    color before the page is cropped to the bounding box of the remaining ink.
+    """
+    def __init__(
+            self,
+            furniture_mask: np.ndarray | None = None,
+            grid: int = 32,
+            band: float = 0.2,
+            padding: int = 10,
+            ink_threshold: int = 40):
+        """
+        Args:
+            furniture_mask: bool array of shape (grid, grid) marking furniture cells
+            grid: number of grid cells per page side
+            band: fraction of the page height/width at each edge where furniture is searched
+            padding: pixels kept around the content bounding box
+            ink_threshold: minimum gray level difference to the background to count as ink
+        """
+        self.grid = grid
+        self.band = band
+        self.padding = padding
+        self.ink_threshold = ink_threshold
+        self.furniture_mask = furniture_mask if furniture_mask is not None else np.zeros((grid, grid), dtype=bool)
+
+    def __ink(self, gray: np.ndarray) -> np.ndarray:
+        """
+        Bool mask of the pixels of a grayscale page that differ from the page background.
+        """
+        gray = gray.astype(np.int16)
+        border = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+        background = int(np.median(border))
+        return np.abs(gray - background) > self.ink_threshold
+
+    def __band_mask(self) -> np.ndarray:
+        edge = max(1, int(round(self.grid * self.band)))
+        mask = np.zeros((self.grid, self.grid), dtype=bool)
+        mask[:edge] = mask[-edge:] = True
+        mask[:, :edge] = mask[:, -edge:] = True
+        return mask
+
+    @classmethod
+    def fit(
+            cls,
+            pages: list[PIL.Image.Image],
+            furniture_ratio: float = 0.6,
+            min_pages: int = 3,
+            max_samples: int = 64,
+            cell_pixels: int = 16,
+            min_overlap: float = 0.8,
+            **kwargs) -> "PageLayout":
+        """
+        Learn the repeated page furniture of a deck.
+
+        Args:
+            pages: list of PIL images of the deck
+            furniture_ratio: fraction of pages on which a cell must show the same ink to
+            count as furniture
+            min_pages: decks with fewer pages are not searched for furniture
+            max_samples: at most this many evenly spaced pages are compared
+            cell_pixels: side length of a grid cell in the downscaled pages
+            min_overlap: minimum intersection over union of the ink of a cell with the
+            ink most pages share there for the cell to count as repeated
+            kwargs: further arguments of PageLayout
+        Returns:
+            PageLayout: the fitted layout
+        """
+        layout = cls(**kwargs)
+        if len(pages) < min_pages:
+            return layout
+
+        grid = layout.grid
+        size = grid * cell_pixels
+        indices = np.unique(np.linspace(0, len(pages) - 1, min(len(pages), max_samples)).astype(int))
+        ink = np.stack([
+            layout.__ink(np.asarray(pages[i].convert("L").resize((size, size), Image.Resampling.BOX)))
+            for i in indices
+        ])
+
+        # A cell only counts as furniture if it shows the same ink on most pages, e.g.
+        # a logo or a footer. Body text and slide titles also put ink into the edge
+        # bands, but their ink differs from page to page.
+        n = len(ink)
+        shared = ink.sum(axis=0) * 2 >= n
+        cells = (n, grid, cell_pixels, grid, cell_pixels)
+        intersection = (ink & shared).reshape(cells).sum(axis=(2, 4))
+        union = (ink | shared).reshape(cells).sum(axis=(2, 4))
+        repeated = intersection >= min_overlap * np.maximum(union, 1)
+        repeated &= union > 0
+
+        layout.furniture_mask = (repeated.sum(axis=0) >= furniture_ratio * n) & layout.__band_mask()
+        return layout
+
+    def crop(self, page: PIL.Image.Image) -> PIL.Image.Image:
+        """
+        Remove page furniture and crop the page to its content region.
+
+        Args:
+            page: PIL image of the page
+        Returns:
+            PIL.Image.Image: the cropped page, or the original page if it has no content
+        """
+        page = page.convert("RGB")
+        ink = self.__ink(np.asarray(page.convert("L")))
+        h, w = ink.shape
+
+        if self.furniture_mask.any():
+            rows = np.minimum(np.arange(h) * self.grid // h, self.grid - 1)
+            cols = np.minimum(np.arange(w) * self.grid // w, self.grid - 1)
+            furniture = self.furniture_mask[rows[:, None], cols[None, :]]
+            ink &= ~furniture
+
+            pixels = np.array(page)
+            border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+            pixels[furniture] = np.median(border, axis=0).astype(np.uint8)
+            page = Image.fromarray(pixels)
+
+        ink_rows = np.flatnonzero(ink.any(axis=1))
+        ink_cols = np.flatnonzero(ink.any(axis=0))
+        if len(ink_rows) == 0:
+            return page
+
+        top = max(0, ink_rows[0] - self.padding)
+        bottom = min(h, ink_rows[-1] + 1 + self.padding)
+        left = max(0, ink_cols[0] - self.padding)
+        right = min(w, ink_cols[-1] + 1 + self.padding)
+        return page.crop((left, top, right, bottom))
+
@@ -1,7 +1,11 @@
+import time
 import streamlit as st
 
 from pdf_viewer import view_pdf
-from creator import FlashCardCreator, flashcard_struct_to_df
+from creator import flashcard_struct_to_df
+from jobs import get_job_queue
+from document_store import get_document_store
+from anki_export import flashcard_struct_to_apkg
 
 
 def main():
@@ -15,7 +19,7 @@ def main():
     uploaded = st.file_uploader("Upload a PDF file", type="pdf")
 
     if uploaded:
-        pages, selected = view_pdf(uploaded)
+        doc_hash, pages, selected = view_pdf(uploaded)
         
         # chapter = file name without the .pdf extension
         chapter = uploaded.name.split(".")[0]
@@ -39,25 +43,94 @@ def main():
         if exercise_flashcards:
             st.info("ℹ️ Exercise mode is enabled. Cost efficient mode is automatically disabled for exercise documents.")
 
+        crop_regions = st.checkbox(
+            "Crop page furniture",
+            help="Remove headers, footers and logos repeated on most pages and crop the margins before sending pages to the model."
+        )
+
+        refresh = st.checkbox(
+            "Regenerate flashcards",
+            help="Ignore flashcards stored for this document by earlier runs and create new ones."
+        )
+
+        queue = get_job_queue()
+        file_suffix = "_exercises" if exercise_flashcards else ""
+
         if st.button("Create flashcards") and selected:
             flashcard_type = "exercise" if exercise_flashcards else "regular"
             st.write(f"Creating {flashcard_type} flashcards for pages: {selected}")
-            
-            # Show processing message
-            with st.spinner("Analyzing document..."):
-                creator = FlashCardCreator(pages, selected, chapter, cost_efficient=cost_efficient, exercise_flashcards=exercise_flashcards)
-                flashcards = creator.create_flashcards()
-
-            df = flashcard_struct_to_df(flashcards)
-            st.write(df)
-
-            # Download button with appropriate filename
-            file_suffix = "_exercises" if exercise_flashcards else ""
-            st.download_button(
-                label="Download flashcards",
-                data=df.to_csv(index=False, sep=";"),
-                file_name=f"{chapter}{file_suffix}.csv"
+
+            # Generation runs in the background so reruns don't cancel or repeat it
+            st.session_state["job_id"] = queue.submit(
+                pages, selected, chapter,
+                cost_efficient=cost_efficient, exercise_flashcards=exercise_flashcards,
+                document_store=get_document_store(), doc_hash=doc_hash, refresh=refresh,
+                crop_regions=crop_regions
             )
+            st.session_state["job_name"] = f"{chapter}{file_suffix}"
+
+        job_id = st.session_state.get("job_id")
+        job = queue.status(job_id) if job_id else None
+        if job is None:
+            return
+
+        if job["status"] in ("queued", "running"):
+            # Show processing message and poll the job table
+            st.progress(
+                job["progress"] / job["total"] if job["total"] else 0.0,
+                text=f"Creating flashcards... {job['progress']}/{job['total']} pages"
+            )
+            time.sleep(1)
+            st.rerun()
+
+        stats = job["stats"]
+        if job["status"] == "failed":
+            st.error(f"Error creating flashcards: {job['error']}")
+            return
+
+        if stats and stats.get('errors'):
+            st.warning(
+                f"{len(stats['errors'])} request(s) failed, their pages have no flashcards: "
+                + "; ".join(dict.fromkeys(stats['errors']))
+            )
+        if stats and stats['escalation']['text_pages']:
+            escalation = stats['escalation']
+            st.caption(
+                f"{escalation['text_pages'] - escalation['escalated']}/{escalation['text_pages']} pages routed to a "
+                f"cheaper model were served by it, {escalation['escalated']} escalated "
+                f"(+{escalation['extra_latency']:.1f}s)"
+            )
+        if stats and stats['tokens']['reserved_tokens']:
+            tokens = stats['tokens']
+            headroom = 1 - tokens['completion_tokens'] / tokens['reserved_tokens']
+            st.caption(
+                f"{tokens['completion_tokens']} of {tokens['reserved_tokens']} reserved output tokens used "
+                f"({headroom:.0%} quota headroom), {tokens['truncated']} truncated, {tokens['retries']} retried"
+            )
+
+        flashcards = queue.result(job_id)
+        df = flashcard_struct_to_df(flashcards)
+        st.write(df)
+
+        # Download button with appropriate filename
+        job_name = st.session_state["job_name"]
+        st.download_button(
+            label="Download flashcards",
+            data=df.to_csv(index=False, sep=";"),
+            file_name=f"{job_name}.csv"
+        )
+        existing_package = st.file_uploader(
+            "Update an existing Anki package (optional)",
+            type="apkg",
+            help="Upload a previously exported package to add the new flashcards to it. Cards of earlier exports are updated instead of duplicated."
+        )
+        st.download_button(
+            label="Download Anki package",
+            data=flashcard_struct_to_apkg(
+                flashcards, job_name, existing_package.getvalue() if existing_package else None
+            ),
+            file_name=f"{job_name}.apkg"
+        )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,134 @@
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from pathlib import Path
+
+import PIL
+from PIL import Image
+
+
+DEFAULT_MAX_MEMORY = int(os.getenv("FLASHCARD_PAGE_MEMORY_MB", "512")) * 1024 * 1024
+
+
+def image_nbytes(image: PIL.Image.Image) -> int:
+    """
+    Approximate memory footprint of a decoded PIL image.
+    """
+    return image.width * image.height * len(image.getbands())
+
+
+class PageCache:
+    """
+    Process-wide LRU cache of decoded pages with a memory ceiling. Pages that do not
+    fit are dropped and decoded again from disk on their next use.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_MEMORY):
+        """
+        Args:
+            max_bytes: memory ceiling of all decoded pages in bytes
+        """
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._images = OrderedDict()  # path -> decoded image
+        self._lock = threading.Lock()
+
+    def load(self, path: Path) -> PIL.Image.Image:
+        """
+        Get the decoded page stored at path.
+
+        Args:
+            path: path of the page file
+        Returns:
+            PIL.Image.Image: the decoded page
+        """
+        with self._lock:
+            image = self._images.get(path)
+            if image is not None:
+                self._images.move_to_end(path)
+                return image
+
+        with Image.open(path) as file:
+            image = file.copy()
+
+        size = image_nbytes(image)
+        with self._lock:
+            if path not in self._images and size <= self.max_bytes:
+                self._images[path] = image
+                self.used_bytes += size
+                while self.used_bytes > self.max_bytes:
+                    _, evicted = self._images.popitem(last=False)
+                    self.used_bytes -= image_nbytes(evicted)
+        return image
+
+    def discard(self, paths: list[Path]):
+        """
+        Drop pages from the cache, e.g. when the document store deletes their files.
+        """
+        with self._lock:
+            for path in paths:
+                image = self._images.pop(path, None)
+                if image is not None:
+                    self.used_bytes -= image_nbytes(image)
+
+
+_cache = PageCache()
+
+
+def get_page_cache() -> PageCache:
+    """
+    Get the process-wide cache of decoded pages.
+    """
+    return _cache
+
+
+class PageSequence(Sequence):
+    """
+    Read-only list of pages that are stored as compressed files on disk and decoded
+    only while a stage works on them. Decoded pages are shared through a PageCache with
+    a memory ceiling, so long selections from huge documents run with bounded memory.
+    It can be used wherever a list of PIL images is expected, as long as the consumer
+    does not keep references to all pages at once.
+    """
+    def __init__(self, paths: list[Path], cache: PageCache | None = None):
+        """
+        Args:
+            paths: paths of the page files in page order
+            cache: cache of decoded pages, defaults to the process-wide cache
+        """
+        self.paths = [Path(path) for path in paths]
+        self.cache = cache or _cache
+
+    def select(self, indices: list[int]) -> "PageSequence":
+        """
+        Get a subset of the pages without decoding them.
+
+        Args:
+            indices: list of page indices
+        Returns:
+            PageSequence: the selected pages
+        """
+        return PageSequence([self.paths[i] for i in indices], self.cache)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PageSequence(self.paths[index], self.cache)
+        return self.cache.load(self.paths[index])
+
+
+def select_pages(pages: Sequence, indices: list[int]) -> Sequence:
+    """
+    Select a subset of pages, keeping file-backed pages on disk.
+
+    Args:
+        pages: list of PIL images or PageSequence
+        indices: list of page indices
+    Returns:
+        Sequence: the selected pages, of the same kind as pages
+    """
+    if isinstance(pages, PageSequence):
+        return pages.select(indices)
+    return [pages[i] for i in indices]
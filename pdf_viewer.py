@@ -1,23 +1,217 @@
+import subprocess
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
 import streamlit as st
+from PIL import Image
 from pdf2image import convert_from_bytes
 
-def view_pdf(uploader) -> tuple[list, list]:
+from document_store import get_document_store
+
+THUMBNAILS_PER_PAGE = 24
+THUMBNAIL_COLUMNS = 6
+THUMBNAIL_WIDTH = 240
+
+
+def render_pdf(pdf: bytes, dpi: int, output_folder: str) -> list[Path]:
+    """
+    Render a PDF page by page to PNG files, so the document is never held in memory
+    as a whole.
+
+    Args:
+        pdf: raw bytes of the PDF
+        dpi: resolution of the render
+        output_folder: directory the PNG files are written to
+
+    Returns:
+        list[Path]: paths of the rendered pages in page order
     """
-    Render uploaded PDF, return (pages_images, selected_page_indices).
-    
+    paths = convert_from_bytes(pdf, dpi=dpi, output_folder=output_folder, fmt="png", paths_only=True)
+    return [Path(path) for path in paths]
+
+
+def extract_text_layer(pdf: bytes) -> list[str] | None:
+    """
+    Extract the embedded text of every page with poppler's pdftotext, which is
+    installed alongside pdf2image.
+
+    Args:
+        pdf: raw bytes of the PDF
+    Returns:
+        list[str] | None: text per page (empty for scanned pages), or None if
+        pdftotext is not available or fails
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "document.pdf"
+        path.write_bytes(pdf)
+        try:
+            result = subprocess.run(
+                ["pdftotext", "-layout", "-enc", "UTF-8", str(path), "-"],
+                capture_output=True, check=True
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    # Every page ends with a form feed
+    return result.stdout.decode("utf-8", errors="replace").split("\f")[:-1]
+
+
+def _store_text_layer(store, doc_hash: str, pdf: bytes):
+    """
+    Store the text layer of a new document, so exercise mode can index the pages
+    without OCR. Pages without embedded text are left to OCR.
+    """
+    if store.get_analysis(doc_hash, 0, "text") is not None:
+        return
+    for page, text in enumerate(extract_text_layer(pdf) or []):
+        if text.strip():
+            store.put_analysis(doc_hash, page, "text", {"text": text})
+
+
+def parse_page_ranges(expression: str, page_count: int) -> list[int]:
+    """
+    Parse a page range expression such as "1-20,35" into page indices.
+
+    Args:
+        expression: comma separated 1-based page numbers and inclusive ranges
+        page_count: number of pages in the document
+
+    Returns:
+        list[int]: sorted 0-based page indices
+
+    Raises:
+        ValueError: if the expression is malformed or out of range
+    """
+    selected = set()
+    for part in expression.replace(" ", "").split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        if not start.isdigit() or (end and not end.isdigit()):
+            raise ValueError(f"Invalid page range: {part}")
+        first, last = int(start), int(end or start)
+        if not 1 <= first <= last <= page_count:
+            raise ValueError(f"Page range {part} is outside of 1-{page_count}")
+        selected.update(range(first - 1, last))
+    return sorted(selected)
+
+
+@st.cache_data(max_entries=2000, show_spinner=False)
+def _thumbnail(path: str, width: int = THUMBNAIL_WIDTH) -> bytes:
+    """
+    Small JPEG preview of a rendered page, cached across reruns and sessions.
+    """
+    with Image.open(path) as page:
+        page = page.convert("RGB")
+        page.thumbnail((width, width * 2))
+        buffered = BytesIO()
+        page.save(buffered, format="JPEG", quality=80)
+    return buffered.getvalue()
+
+
+def _set_selection(selected: set[int], expression: str | None = None):
+    st.session_state["selected_pages"] = selected
+    if expression is not None:
+        st.session_state["page_ranges"] = expression
+        st.session_state["page_ranges_error"] = None
+    # New checkbox keys so the visible checkboxes pick up the bulk change
+    st.session_state["selection_version"] += 1
+
+
+def _apply_ranges(page_count: int):
+    try:
+        _set_selection(set(parse_page_ranges(st.session_state["page_ranges"], page_count)))
+        st.session_state["page_ranges_error"] = None
+    except ValueError as e:
+        st.session_state["page_ranges_error"] = str(e)
+
+
+def _toggle_page(i: int, key: str):
+    if st.session_state[key]:
+        st.session_state["selected_pages"].add(i)
+    else:
+        st.session_state["selected_pages"].discard(i)
+
+
+@st.fragment
+def _page_selector(pages):
+    """
+    Page selection controls. Runs as a fragment, so interacting with it only reruns
+    this function and only the thumbnails of the current grid page are rebuilt.
+    """
+    page_count = len(pages)
+    selected = st.session_state["selected_pages"]
+
+    c0, c1, c2 = st.columns([4, 1, 1])
+    with c0:
+        st.text_input(
+            "Pages to process",
+            key="page_ranges",
+            placeholder="e.g. 1-20,35",
+            on_change=_apply_ranges,
+            args=(page_count,)
+        )
+    with c1:
+        st.button("Select all", on_click=_set_selection, args=(set(range(page_count)), f"1-{page_count}"))
+    with c2:
+        st.button("Clear", on_click=_set_selection, args=(set(), ""))
+
+    if st.session_state["page_ranges_error"]:
+        st.error(st.session_state["page_ranges_error"])
+    st.caption(f"{len(selected)} of {page_count} pages selected")
+
+    grid_pages = (page_count + THUMBNAILS_PER_PAGE - 1) // THUMBNAILS_PER_PAGE
+    grid_page = 1
+    if grid_pages > 1:
+        grid_page = st.number_input("Preview page", min_value=1, max_value=grid_pages, step=1)
+
+    start = (grid_page - 1) * THUMBNAILS_PER_PAGE
+    version = st.session_state["selection_version"]
+    columns = st.columns(THUMBNAIL_COLUMNS)
+    for i in range(start, min(start + THUMBNAILS_PER_PAGE, page_count)):
+        with columns[(i - start) % THUMBNAIL_COLUMNS]:
+            st.image(_thumbnail(str(pages.paths[i])), use_container_width=True)
+            key = f"pg{i}-{version}"
+            st.checkbox(f"{i+1}", value=i in selected, key=key, on_change=_toggle_page, args=(i, key))
+
+
+def view_pdf(uploader) -> tuple[str, list, list]:
+    """
+    Render uploaded PDF, return (document_hash, pages_images, selected_page_indices).
+    Renders are shared between sessions through the document store and only looked up
+    once per uploaded file. Pages are selected with a range expression or on a
+    paginated thumbnail grid.
+
     Args:
         uploader: streamlit file_uploader object
 
     Returns:
-        tuple: (pages_images, selected_page_indices)
-    """
-    pages = convert_from_bytes(uploader.read(), dpi=100)
-    selected = []
-    for i, img in enumerate(pages):
-        c0, c1 = st.columns([1, 5])
-        with c0:
-            if st.checkbox(f"{i+1}", key=f"pg{i}"):
-                selected.append(i)
-        with c1:
-            st.image(img, use_container_width=True)
-    return pages, selected
\ No newline at end of file
+        tuple: (document_hash, pages_images, selected_page_indices)
+    """
+    upload_key = getattr(uploader, "file_id", None) or f"{uploader.name}-{uploader.size}"
+    store = get_document_store()
+    new_upload = st.session_state.get("pdf_upload_key") != upload_key
+    # Pages of an idle session may have been evicted from the store, render them again
+    paths = [] if new_upload else st.session_state["pdf_pages"].paths
+    stale = bool(paths) and not paths[0].exists()
+    if new_upload or stale:
+        with tempfile.TemporaryDirectory() as output_folder:
+            doc_hash, pages = store.pages(
+                uploader.getvalue(), 100, lambda pdf, dpi: render_pdf(pdf, dpi, output_folder)
+            )
+        st.session_state.update({"pdf_upload_key": upload_key, "pdf_doc_hash": doc_hash, "pdf_pages": pages})
+    else:
+        # Keep the document within the eviction grace window while the session uses it
+        store.touch(st.session_state["pdf_doc_hash"])
+    if new_upload:
+        _store_text_layer(store, st.session_state["pdf_doc_hash"], uploader.getvalue())
+        st.session_state.update({
+            "selected_pages": set(),
+            "selection_version": 0,
+            "page_ranges": "",
+            "page_ranges_error": None,
+        })
+
+    pages = st.session_state["pdf_pages"]
+    _page_selector(pages)
+    return st.session_state["pdf_doc_hash"], pages, sorted(st.session_state["selected_pages"])
@@ -0,0 +1,202 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+
+API_MODE = os.getenv("FLASHCARD_API_MODE", "live")  # live, record or replay
+DEFAULT_ARCHIVE_PATH = Path(os.getenv("FLASHCARD_API_ARCHIVE", "api_archive.jsonl.gz"))
+
+
+class ReplayMissError(LookupError):
+    """
+    Raised in replay mode when a request was never recorded.
+    """
+
+
+def request_fingerprint(request: dict) -> str:
+    """
+    Fingerprint of a chat completion request. The request is serialized canonically,
+    so the same model and messages (including images) always produce the same
+    fingerprint. max_tokens is left out: it is predicted per page from
+    token_model.json, and refitting the predictor must not invalidate the recordings.
+    If a request was recorded with several budgets, the latest recording is replayed.
+
+    Args:
+        request: keyword arguments of chat.completions.create
+    Returns:
+        str: hex SHA-256 of the request
+    """
+    request = {key: value for key, value in request.items() if key != "max_tokens"}
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _to_response(entry: dict) -> SimpleNamespace:
+    """
+    Rebuild the parts of a chat completion response the creator uses.
+    """
+    return SimpleNamespace(
+        model=entry["model"],
+        choices=[SimpleNamespace(
+            finish_reason=entry["finish_reason"],
+            message=SimpleNamespace(role="assistant", content=entry["content"]),
+        )],
+        usage=SimpleNamespace(**entry["usage"]) if entry["usage"] else None,
+    )
+
+
+class ApiArchive:
+    """
+    Compact archive of recorded API interactions. Each interaction is one JSON line
+    holding the request fingerprint, the response content, finish reason, token usage
+    and latency. Lines are appended as separate gzip members, so recording never
+    rewrites the archive.
+    """
+    def __init__(self, path: str | Path = DEFAULT_ARCHIVE_PATH):
+        """
+        Args:
+            path: path of the archive
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries = None  # fingerprint -> entry, loaded on first lookup
+
+    def load(self) -> dict[str, dict]:
+        """
+        Load all recorded interactions.
+
+        Returns:
+            dict[str, dict]: fingerprint -> recorded entry
+        """
+        with self._lock:
+            if self._entries is None:
+                self._entries = {}
+                if self.path.exists():
+                    with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                        for line in f:
+                            entry = json.loads(line)
+                            self._entries[entry["fingerprint"]] = entry
+            return self._entries
+
+    def append(self, entry: dict):
+        """
+        Record one interaction.
+        """
+        with self._lock:
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            if self._entries is not None:
+                self._entries[entry["fingerprint"]] = entry
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_archive(path: str | Path = DEFAULT_ARCHIVE_PATH) -> ApiArchive:
+    """
+    Get the process-wide archive for a path, so all creators share one loaded copy.
+    """
+    path = Path(path).resolve()
+    with _archives_lock:
+        if path not in _archives:
+            _archives[path] = ApiArchive(path)
+        return _archives[path]
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class RecordingClient:
+    """
+    Drop-in replacement for the part of openai.OpenAI the creator uses
+    (client.chat.completions.create). In record mode requests go to the wrapped
+    client and every response is written to the archive. In replay mode responses
+    are served from the archive without network access, optionally with the
+    recorded latency simulated, so pipeline runs are deterministic and free.
+    """
+    def __init__(
+            self,
+            archive: ApiArchive,
+            client=None,
+            mode: str = "replay",
+            latency_scale: float = 0.0):
+        """
+        Args:
+            archive: ApiArchive to record to or replay from
+            client: wrapped openai.OpenAI client, required in record mode
+            mode: "record" or "replay"
+            latency_scale: factor applied to the recorded latency when replaying,
+            0 disables the simulated latency
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown API mode: {mode}")
+        if mode == "record" and client is None:
+            raise ValueError("Record mode needs a client to record from")
+        self.archive = archive
+        self.client = client
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.chat = SimpleNamespace(completions=_Completions(self.__create))
+
+    def __create(self, **request):
+        fingerprint = request_fingerprint(request)
+
+        if self.mode == "replay":
+            entry = self.archive.load().get(fingerprint)
+            if entry is None:
+                raise ReplayMissError(f"No recorded response for request {fingerprint[:12]} ({request.get('model')})")
+            if self.latency_scale:
+                time.sleep(entry["latency"] * self.latency_scale)
+            return _to_response(entry)
+
+        start = time.perf_counter()
+        response = self.client.chat.completions.create(**request)
+        latency = time.perf_counter() - start
+
+        choice = response.choices[0]
+        usage = response.usage
+        self.archive.append({
+            "fingerprint": fingerprint,
+            "model": request.get("model"),
+            "content": choice.message.content,
+            "finish_reason": choice.finish_reason,
+            "usage": {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            } if usage else None,
+            "latency": latency,
+        })
+        return response
+
+
+def create_client(api_key: str | None, mode: str = API_MODE, archive_path: str | Path = DEFAULT_ARCHIVE_PATH):
+    """
+    Create the OpenAI client for the configured API mode. "live" returns a plain
+    openai.OpenAI client, "record" wraps it in a RecordingClient and "replay" serves
+    recorded responses without creating an OpenAI client at all.
+
+    Args:
+        api_key: OpenAI API key
+        mode: "live", "record" or "replay", defaults to FLASHCARD_API_MODE
+        archive_path: path of the archive, defaults to FLASHCARD_API_ARCHIVE
+    Returns:
+        client with a chat.completions.create method
+    """
+    if mode == "replay":
+        latency_scale = float(os.getenv("FLASHCARD_REPLAY_LATENCY", "0"))
+        return RecordingClient(get_archive(archive_path), mode="replay", latency_scale=latency_scale)
+
+    import openai
+    client = openai.OpenAI(api_key=api_key)
+    if mode == "record":
+        return RecordingClient(get_archive(archive_path), client, mode="record")
+    return client
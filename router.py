@@ -0,0 +1,331 @@
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+DEFAULT_LOG_PATH = Path("routing_log.jsonl")
+DEFAULT_POLICY_PATH = Path("routing_policy.json")
+# Fraction of pages routed to a random cheaper tier to collect training data for it
+DEFAULT_EXPLORATION = float(os.getenv("FLASHCARD_ROUTING_EXPLORATION", "0.1"))
+
+# Model tiers ordered from cheapest to most expensive. "input" decides whether the
+# tier receives the OCR text of the page or the page image.
+DEFAULT_TIERS = [
+    {"model": "gpt-3.5-turbo", "input": "text"},
+    {"model": "gpt-4o", "input": "image"},
+]
+
+FEATURES = [
+    "text_ratio", "complexity_score", "graphics_count", "text_length",
+    "formula_density", "bullet_ratio", "table_ratio", "digit_ratio",
+]
+
+
+def page_features(analysis: dict) -> dict[str, float]:
+    """
+    Extract the routing features from a single page analysis of FileAnalyzer.
+
+    Args:
+        analysis: analysis dictionary of one page
+    Returns:
+        dict[str, float]: feature name -> value
+    """
+    return {
+        "text_ratio": float(analysis.get("text_ratio", 0.0)),
+        "complexity_score": float(analysis.get("complexity_score", 0.0)),
+        "graphics_count": float(analysis.get("graphics_count", 0)),
+        "text_length": float(len(analysis.get("text", "").strip())),
+        "formula_density": float(analysis.get("formula_density", 0.0)),
+        "bullet_ratio": float(analysis.get("bullet_ratio", 0.0)),
+        "table_ratio": float(analysis.get("table_ratio", 0.0)),
+        "digit_ratio": float(analysis.get("digit_ratio", 0.0)),
+    }
+
+
+class RoutingLog:
+    """
+    Append-only JSON lines log of routing features and per-page outcomes. Each line
+    holds the features the router saw, the tier that served the page and what came
+    back (card count, truncation, token cost). The log is the training data for
+    RoutingPolicy.fit.
+    """
+    def __init__(self, path: str | Path = DEFAULT_LOG_PATH):
+        """
+        Args:
+            path: path of the JSON lines file
+        """
+        self.path = Path(path)
+
+    def record(
+            self,
+            features: dict[str, float],
+            model: str,
+            card_count: int,
+            truncated: bool,
+            total_tokens: int,
+            completion_tokens: int | None = None):
+        """
+        Append the outcome of one page to the log.
+
+        Args:
+            features: routing features of the page
+            model: model that served the page
+            card_count: number of flashcards parsed from the response
+            truncated: whether the response hit the max_tokens limit
+            total_tokens: prompt + completion tokens spent on the page
+            completion_tokens: output tokens of the final response
+        """
+        entry = {
+            "timestamp": time.time(),
+            "features": features,
+            "model": model,
+            "card_count": card_count,
+            "truncated": truncated,
+            "total_tokens": total_tokens,
+            "completion_tokens": completion_tokens,
+        }
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def read(self) -> list[dict]:
+        """
+        Read all entries of the log.
+
+        Returns:
+            list[dict]: log entries, empty if the log does not exist
+        """
+        if not self.path.exists():
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+def _fit_logistic(
+        x: np.ndarray,
+        y: np.ndarray,
+        l2: float = 1e-2,
+        lr: float = 0.5,
+        iterations: int = 2000) -> tuple[np.ndarray, float]:
+    """
+    Fit an L2 regularized logistic regression with batch gradient descent.
+
+    Args:
+        x: standardized feature matrix of shape (n, d)
+        y: binary labels of shape (n,)
+    Returns:
+        tuple[np.ndarray, float]: (weights, bias)
+    """
+    n, d = x.shape
+    w = np.zeros(d)
+    b = 0.0
+    for _ in range(iterations):
+        p = _sigmoid(x @ w + b)
+        err = p - y
+        w -= lr * (x.T @ err / n + l2 * w)
+        b -= lr * err.mean()
+    return w, float(b)
+
+
+def _is_success(entry: dict, min_cards: int) -> bool:
+    return entry["card_count"] >= min_cards and not entry["truncated"]
+
+
+class RoutingPolicy:
+    """
+    Routes a page to the cheapest model tier that is expected to handle it. For every
+    tier except the last one a logistic model predicts the probability that the tier
+    produces a usable result (enough cards, no truncation) from the analyzer features.
+    A page goes to the first tier whose predicted probability reaches the tier's
+    threshold, the last tier is the fallback. Tiers without a fitted model use the
+    original hand-tuned rule of FileAnalyzer.
+
+    A fraction of pages is routed to a random cheaper tier instead (exploration).
+    The log only holds outcomes of the tier that served a page, so without
+    exploration a tier the policy never picks never collects the samples it needs
+    to be fitted.
+    """
+    def __init__(
+            self,
+            tiers: list[dict] | None = None,
+            models: dict[str, dict] | None = None,
+            text_threshold: float = 0.75,
+            exploration: float = DEFAULT_EXPLORATION,
+            seed: int | None = None):
+        """
+        Args:
+            tiers: list of {"model": str, "input": "text" | "image"} ordered from
+            cheapest to most expensive
+            models: fitted logistic models per tier model name, each a dict with
+            features, mean, std, weights, bias and threshold
+            text_threshold: text ratio threshold of the fallback rule
+            exploration: probability of routing a page to a random cheaper tier,
+            defaults to FLASHCARD_ROUTING_EXPLORATION
+            seed: seed of the exploration random generator
+        """
+        self.tiers = tiers or DEFAULT_TIERS
+        self.models = models or {}
+        self.text_threshold = text_threshold
+        self.exploration = exploration
+        self._rng = np.random.default_rng(seed)
+
+    def success_probability(self, model: str, features: dict[str, float]) -> float | None:
+        """
+        Predicted probability that the given tier serves the page successfully.
+
+        Returns:
+            float | None: probability, or None if the tier has no fitted model
+        """
+        params = self.models.get(model)
+        if params is None:
+            return None
+        # Policies fitted before features were added keep using their own feature list
+        x = np.array([features.get(name, 0.0) for name in params.get("features", FEATURES[:4])])
+        x = (x - np.array(params["mean"])) / np.array(params["std"])
+        return float(_sigmoid(x @ np.array(params["weights"]) + params["bias"]))
+
+    def choose(self, features: dict[str, float]) -> dict:
+        """
+        Choose the model tier for a page.
+
+        Args:
+            features: routing features of the page (see page_features)
+        Returns:
+            dict: the chosen tier
+        """
+        if len(self.tiers) > 1 and self._rng.random() < self.exploration:
+            return self.tiers[int(self._rng.integers(len(self.tiers) - 1))]
+
+        for tier in self.tiers[:-1]:
+            probability = self.success_probability(tier["model"], features)
+            if probability is None:
+                # Fallback rule, only meaningful for text tiers
+                if tier["input"] == "text" and not (
+                        features["text_ratio"] < self.text_threshold
+                        or features["complexity_score"] > 0.9):
+                    return tier
+            elif probability >= self.models[tier["model"]]["threshold"]:
+                return tier
+        return self.tiers[-1]
+
+    @classmethod
+    def fit(
+            cls,
+            entries: list[dict],
+            tiers: list[dict] | None = None,
+            target_success: float = 0.95,
+            min_cards: int = 1,
+            min_samples: int = 20) -> "RoutingPolicy":
+        """
+        Fit the routing policy from log entries.
+
+        For each tier a logistic model is fitted on the pages that tier served. These
+        are not a random sample: apart from explored pages, a tier only serves the
+        pages the previous policy sent to it, so the model is biased towards them and
+        its predictions for other pages rest mostly on the explored ones. The
+        acceptance threshold is the lowest predicted probability for which the pages
+        the tier would accept still reach target_success on the logged data, so
+        routing pushes as many pages as possible to the cheap tier without going
+        below the quality target.
+
+        Args:
+            entries: entries of a RoutingLog
+            tiers: model tiers, defaults to DEFAULT_TIERS
+            target_success: required success rate of the accepted pages
+            min_cards: minimum number of cards for a page to count as success
+            min_samples: tiers with fewer logged pages keep the fallback rule
+        Returns:
+            RoutingPolicy: the fitted policy
+        """
+        tiers = tiers or DEFAULT_TIERS
+        models = {}
+
+        for tier in tiers[:-1]:
+            rows = [e for e in entries if e["model"] == tier["model"]]
+            if len(rows) < min_samples:
+                continue
+
+            x = np.array([[e["features"].get(name, 0.0) for name in FEATURES] for e in rows], dtype=float)
+            y = np.array([_is_success(e, min_cards) for e in rows], dtype=float)
+            if y.min() == y.max():
+                # Only one class observed, nothing to separate
+                continue
+
+            mean = x.mean(axis=0)
+            std = x.std(axis=0)
+            std[std == 0] = 1.0
+            xs = (x - mean) / std
+            weights, bias = _fit_logistic(xs, y)
+
+            # Sweep candidate thresholds from high to low and keep the lowest one
+            # whose accepted pages still meet the target success rate
+            probabilities = _sigmoid(xs @ weights + bias)
+            order = np.argsort(-probabilities)
+            cumulative_success = np.cumsum(y[order]) / np.arange(1, len(y) + 1)
+            valid = np.nonzero(cumulative_success >= target_success)[0]
+            threshold = float(probabilities[order][valid[-1]]) if len(valid) else 1.0
+
+            models[tier["model"]] = {
+                "features": FEATURES,
+                "mean": mean.tolist(),
+                "std": std.tolist(),
+                "weights": weights.tolist(),
+                "bias": bias,
+                "threshold": threshold,
+            }
+
+        return cls(tiers, models)
+
+    def save(self, path: str | Path = DEFAULT_POLICY_PATH):
+        """
+        Save the policy as JSON.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "tiers": self.tiers,
+                "models": self.models,
+                "text_threshold": self.text_threshold,
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str | Path = DEFAULT_POLICY_PATH) -> "RoutingPolicy":
+        """
+        Load a fitted policy. If no policy file exists, the default tiers with the
+        hand-tuned fallback rule are used. The exploration rate is not stored, it
+        always comes from FLASHCARD_ROUTING_EXPLORATION.
+
+        Returns:
+            RoutingPolicy: the loaded policy
+        """
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["tiers"], data["models"], data.get("text_threshold", 0.75))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the model routing policy from a routing log.")
+    parser.add_argument("--log", default=DEFAULT_LOG_PATH, help="path of the routing log")
+    parser.add_argument("--out", default=DEFAULT_POLICY_PATH, help="path of the fitted policy")
+    parser.add_argument("--tiers", help="JSON file with the list of model tiers")
+    parser.add_argument("--target-success", type=float, default=0.95)
+    args = parser.parse_args()
+
+    tiers = None
+    if args.tiers:
+        with open(args.tiers, encoding="utf-8") as f:
+            tiers = json.load(f)
+
+    entries = RoutingLog(args.log).read()
+    policy = RoutingPolicy.fit(entries, tiers, target_success=args.target_success)
+    policy.save(args.out)
+    print(f"Fitted {len(policy.models)} tier model(s) from {len(entries)} log entries -> {args.out}")
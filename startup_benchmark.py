@@ -0,0 +1,71 @@
+import argparse
+import os
+import subprocess
+import sys
+
+
+# Modules that must only be imported on first use, never at startup
+LAZY_MODULES = ["openai", "pandas", "pytesseract", "numpy", "cv2", "few_shot_examples"]
+
+
+def measure_imports(module: str) -> dict[str, int]:
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Args:
+        module: name of the module to import
+    Returns:
+        dict[str, int]: imported module name -> cumulative import time in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"Importing {module} failed:\n" + "\n".join(errors))
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        # Format: "import time: <self us> | <cumulative us> | <indented module name>"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the app and check it against a budget.")
+    parser.add_argument("--module", default="main", help="module to import (default: main)")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "1500")),
+                        help="maximum allowed cumulative import time in milliseconds")
+    parser.add_argument("--runs", type=int, default=5, help="number of measurements, the median is used")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to show")
+    args = parser.parse_args()
+
+    runs = [measure_imports(args.module) for _ in range(args.runs)]
+    totals = sorted(run[args.module] for run in runs)
+    median_ms = totals[len(totals) // 2] / 1000
+
+    slowest = sorted(runs[0].items(), key=lambda item: item[1], reverse=True)[:args.top]
+    print(f"import {args.module}: {median_ms:.1f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    for name, cumulative in slowest:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failures = []
+    eager = [name for name in LAZY_MODULES if name in runs[0]]
+    if eager:
+        failures.append(f"modules that should be lazy were imported at startup: {', '.join(eager)}")
+    if median_ms > args.budget_ms:
+        failures.append(f"import time {median_ms:.1f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
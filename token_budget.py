@@ -0,0 +1,154 @@
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+from router import DEFAULT_LOG_PATH, RoutingLog
+
+
+DEFAULT_MODEL_PATH = Path("token_model.json")
+
+# Only features the basic analysis of cost-efficient mode fills in. complexity_score
+# and graphics_count are always 0 there.
+PREDICTOR_FEATURES = ["text_length", "formula_density", "bullet_ratio", "table_ratio"]
+# Feature list of predictors saved before the features were recorded in the file
+LEGACY_FEATURES = ["text_length", "complexity_score", "graphics_count"]
+
+# Hand-tuned starting point until a model is fitted from the routing log:
+# intercept, tokens per character of page text, per unit formula density, bullet
+# ratio and table ratio
+DEFAULT_COEFFICIENTS = [300.0, 0.5, 600.0, 300.0, 300.0]
+
+
+class TokenPredictor:
+    """
+    Predict the output length of a page from its analyzer features and derive the
+    max_tokens budget of the request. A tight budget reserves less of the
+    tokens-per-minute quota, so more requests can run at once. The prediction is a
+    linear model that can be fitted on the completion tokens in the routing log; the
+    budget adds a safety margin on top and is clamped to [min_tokens, max_tokens].
+    """
+    def __init__(
+            self,
+            coefficients: list[float] | None = None,
+            margin: float = 0.5,
+            min_tokens: int = 256,
+            max_tokens: int = 3000,
+            features: list[str] | None = None):
+        """
+        Args:
+            coefficients: intercept followed by one weight per feature
+            margin: relative safety margin added to the prediction
+            min_tokens: smallest budget handed out
+            max_tokens: largest budget handed out
+            features: names of the features the coefficients belong to, defaults to
+            PREDICTOR_FEATURES
+        """
+        self.coefficients = coefficients or DEFAULT_COEFFICIENTS
+        self.features = features or PREDICTOR_FEATURES
+        self.margin = margin
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+
+    def predict(self, features: dict[str, float]) -> float:
+        """
+        Expected number of output tokens of a page.
+
+        Args:
+            features: routing features of the page (see router.page_features)
+        Returns:
+            float: predicted completion tokens
+        """
+        x = np.array([1.0] + [features.get(name, 0.0) for name in self.features])
+        return float(x @ np.array(self.coefficients))
+
+    def budget(self, features: dict[str, float]) -> int:
+        """
+        max_tokens budget of a page.
+
+        Args:
+            features: routing features of the page
+        Returns:
+            int: max_tokens for the request
+        """
+        budget = int(np.ceil(self.predict(features) * (1 + self.margin)))
+        return int(np.clip(budget, self.min_tokens, self.max_tokens))
+
+    @classmethod
+    def fit(cls, entries: list[dict], margin: float | None = None, min_samples: int = 20, **kwargs) -> "TokenPredictor":
+        """
+        Fit the linear model with least squares on the completion tokens of complete
+        (not truncated) responses in the routing log. If no margin is given, it is set
+        so that 95% of the logged responses would have fit into their budget.
+
+        Args:
+            entries: entries of a RoutingLog
+            margin: relative safety margin, fitted if None
+            min_samples: with fewer usable entries the default coefficients are kept
+            kwargs: further arguments of TokenPredictor
+        Returns:
+            TokenPredictor: the fitted predictor
+        """
+        rows = [
+            e for e in entries
+            if e.get("completion_tokens") is not None and not e["truncated"]
+        ]
+        if len(rows) < min_samples:
+            return cls(margin=margin if margin is not None else 0.5, **kwargs)
+
+        x = np.array([[1.0] + [e["features"].get(name, 0.0) for name in PREDICTOR_FEATURES] for e in rows])
+        y = np.array([e["completion_tokens"] for e in rows], dtype=float)
+        coefficients, *_ = np.linalg.lstsq(x, y, rcond=None)
+
+        if margin is None:
+            prediction = np.maximum(x @ coefficients, 1.0)
+            margin = max(0.0, float(np.quantile(y / prediction, 0.95)) - 1.0)
+
+        return cls(coefficients.tolist(), margin, **kwargs)
+
+    def save(self, path: str | Path = DEFAULT_MODEL_PATH):
+        """
+        Save the predictor as JSON.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "coefficients": self.coefficients,
+                "margin": self.margin,
+                "min_tokens": self.min_tokens,
+                "max_tokens": self.max_tokens,
+                "features": self.features,
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str | Path = DEFAULT_MODEL_PATH, **kwargs) -> "TokenPredictor":
+        """
+        Load a fitted predictor, or the default one if no file exists.
+
+        Args:
+            path: path of the predictor file
+            kwargs: arguments overriding the stored ones, e.g. max_tokens
+        Returns:
+            TokenPredictor: the loaded predictor
+        """
+        path = Path(path)
+        if not path.exists():
+            return cls(**kwargs)
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        data.setdefault("features", LEGACY_FEATURES)
+        data.update(kwargs)
+        return cls(**data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the output length predictor from a routing log.")
+    parser.add_argument("--log", default=DEFAULT_LOG_PATH, help="path of the routing log")
+    parser.add_argument("--out", default=DEFAULT_MODEL_PATH, help="path of the fitted predictor")
+    parser.add_argument("--max-tokens", type=int, default=3000)
+    args = parser.parse_args()
+
+    entries = RoutingLog(args.log).read()
+    predictor = TokenPredictor.fit(entries, max_tokens=args.max_tokens)
+    predictor.save(args.out)
+    print(f"Fitted predictor from {len(entries)} log entries, margin {predictor.margin:.2f} -> {args.out}")